@@ -15,11 +15,14 @@ from django.conf.urls import patterns, url
 from django.contrib import admin
 from django.contrib.admin import helpers, options
 from django.contrib.admin.util import unquote, quote, get_deleted_objects
+from django.contrib.admin.views.main import PAGE_VAR
+from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.generic import GenericInlineModelAdmin, GenericRelation
 from django.contrib import messages
 from django.core.exceptions import PermissionDenied
-from django.core.urlresolvers import reverse
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.core.urlresolvers import reverse, NoReverseMatch
 from django.forms.formsets import all_valid
 from django.forms.models import model_to_dict
 from django.http import HttpResponseRedirect, HttpResponseNotFound, Http404
@@ -32,16 +35,17 @@ from django.utils.text import capfirst
 from django.utils.translation import ugettext as _
 from django.views.decorators.csrf import csrf_protect
 
-from workflow.models import Version
+from workflow.models import Revision, Version
 from workflow.constants import (
     VERSION_STATUS_NEED_ATTENTION, VERSION_STATUS_APPROVED, VERSION_STATUS_REJECTED, VERSION_STATUS_DRAFT,
     VERSION_TYPE_ADD, VERSION_TYPE_CHANGE, VERSION_TYPE_DELETE, VERSION_TYPE_RECOVER,
     VERSION_BRANCHES_MAX_COUNT)
-from workflow.diff import changes_between_models, comment_from_changes
-from workflow.security import is_user_content_admin, is_user_content_manager
+from workflow.diff import comment_from_changes, register_diff_engines
+from workflow.diffcache import get_changes
+from workflow.security import get_user_roles, is_user_content_admin
 from workflow.revisions import default_revision_manager, RegistrationError
 from workflow.urls import (
-    version_edit_url, version_view_changes_url, version_history_url, version_approve_url, version_reject_url)
+    version_edit_url, version_view_changes_url, version_history_url, version_url_builders)
 
 csrf_protect_m = method_decorator(csrf_protect)
 
@@ -53,12 +57,21 @@ class WorkflowAdmin(admin.ModelAdmin):
     # The revision manager instance used to manage revisions.
     revision_manager = default_revision_manager
 
-    # The serialization format to use when registering models with reversion.
+    # The serialization format to use when registering models with reversion:
+    # a name of a Django serializer or of a format registered in
+    # workflow.formats, e.g. 'compact-json'.
     reversion_format = 'json'
 
     # Whether to ignore duplicate revision data.
     ignore_duplicate_revisions = False
 
+    # Number of versions shown on a page of object's history.
+    history_per_page = 100
+
+    # Diff engines of text fields on the changes page, by field name, e.g.
+    # {'body': 'html'}. Other fields use WORKFLOW_DIFF_ENGINE setting.
+    diff_engines = {}
+
     change_list_template = 'workflow/change_list.html'
     change_form_template = 'workflow/change_form.html'
     object_history_template = 'workflow/object_history.html'
@@ -71,7 +84,7 @@ class WorkflowAdmin(admin.ModelAdmin):
             'all': (STATIC_URL + 'workflow/css/workflow_admin.css', )
         }
 
-    def _autoregister(self, model, follow=None):
+    def _autoregister(self, model, follow=None, diff_engines=None):
         """Registers a model with reversion, if required."""
         if model._meta.proxy:
             raise RegistrationError("Proxy models cannot be used with django-reversion, register the parent class instead")
@@ -80,7 +93,8 @@ class WorkflowAdmin(admin.ModelAdmin):
             for parent_cls, field in model._meta.parents.items():
                 follow.append(field.name)
                 self._autoregister(parent_cls)
-            self.revision_manager.register(model, follow=follow, format=self.reversion_format)
+            self.revision_manager.register(
+                model, follow=follow, format=self.reversion_format, diff_engines=diff_engines)
 
     @property
     def revision_context_manager(self):
@@ -90,6 +104,9 @@ class WorkflowAdmin(admin.ModelAdmin):
     def __init__(self, model, admin_site):
         super(WorkflowAdmin, self).__init__(model, admin_site)
         self.content_type = ContentType.objects.get_for_model(model)
+        # Models registered with the revision manager elsewhere get diff
+        # engines of the admin here, others on registration below.
+        register_diff_engines(model, self.diff_engines)
         # Automatically register models if required.
         if not self.revision_manager.is_registered(self.model):
             inline_fields = []
@@ -116,7 +133,7 @@ class WorkflowAdmin(admin.ModelAdmin):
                     if not inline_model._meta.get_field(fk_name).rel.is_hidden():
                         accessor = inline_model._meta.get_field(fk_name).related.get_accessor_name()
                         inline_fields.append(accessor)
-            self._autoregister(self.model, inline_fields)
+            self._autoregister(self.model, inline_fields, diff_engines=self.diff_engines)
         # Wrap own methods in manual revision management.
         self.add_view = self.revision_context_manager.create_revision(manage_manually=True)(self.add_view)
         self.change_view = self.revision_context_manager.create_revision(manage_manually=True)(self.change_view)
@@ -152,12 +169,8 @@ class WorkflowAdmin(admin.ModelAdmin):
             # This is a GenericInlineFormset, or similar.
             fk_name = FormSet.ct_fk_field.name
         # Look up the revision data.
-        revision_versions = version.revision.version_set.all()
-        related_versions = dict([(related_version.object_id, related_version)
-                                 for related_version in revision_versions
-                                 if ContentType.objects.get_for_id(related_version.content_type_id).model_class() == FormSet.model
-                                 and force_text(related_version.field_dict[fk_name]) == force_text(object_id)])
-        return related_versions
+        index = version.revision.get_related_version_index(FormSet.model, fk_name)
+        return dict(index.get(force_text(object_id), {}))
 
     def _hack_inline_formset_initial(self, FormSet, formset, obj, version):
         """Hacks the given formset to contain the correct initial data."""
@@ -171,9 +184,9 @@ class WorkflowAdmin(admin.ModelAdmin):
         related_versions = self.get_related_versions(obj, version, FormSet)
         formset.related_versions = related_versions
 
+        pk_name = FormSet.model._meta.pk.name
         for related_version in related_versions.values():
-            initial_row = related_version.field_dict
-            pk_name = ContentType.objects.get_for_id(related_version.content_type_id).model_class()._meta.pk.name
+            initial_row = dict(related_version.field_dict)
             del initial_row[pk_name]
             initial.append(initial_row)
 
@@ -357,34 +370,51 @@ class WorkflowAdmin(admin.ModelAdmin):
 
     def history_view(self, request, object_id, extra_context=None):
         object_id = unquote(object_id)
-        opts = self.model._meta
-        latest_approved_id = Version.objects.latest_approved(self.content_type, object_id).id
-        action_list = [
-            {
+        latest_approved = Version.objects.latest_approved(self.content_type, object_id)
+        versions = Version.objects.for_object(
+            self.content_type, object_id
+        ).select_related(
+            'revision', 'revision__created_by', 'revision__moderated_by'
+        ).defer('serialized_data')
+        page = self.get_history_page(request, versions)
+        # Children of all revisions on the page are fetched at once.
+        children_pks = {}
+        for parent_pk, child_pk in Revision.objects.filter(
+            parent__in=[version.revision_id for version in page.object_list]
+        ).values_list('parent', 'pk'):
+            children_pks.setdefault(parent_pk, []).append(child_pk)
+        url_builders = version_url_builders(self.admin_site.name, self.model._meta)
+        action_list = []
+        for version in page.object_list:
+            action = dict(
+                (name, build(version.object_id, version.id))
+                for name, build in url_builders.items())
+            action.update({
                 'revision': version.revision,
-                'edit_url': version_edit_url(version.object_id, version.id, self.admin_site.name, opts),
-                'view_url': version_view_changes_url(version.object_id, version.id, self.admin_site.name, opts),
-                'approve_url': version_approve_url(version.object_id, version.id, self.admin_site.name, opts),
-                'reject_url': version_reject_url(version.object_id, version.id, self.admin_site.name, opts),
-                'recover_url': reverse('%s:%s_%s_recover' % (
-                    self.admin_site.name, opts.app_label, opts.module_name
-                ), args=[version.id]),
-                'is_current': version.id == latest_approved_id,
-                'children_pks': version.revision.children.all().values_list('id', flat=True),
+                'is_current': latest_approved is not None and version.id == latest_approved.id,
+                'children_pks': children_pks.get(version.revision_id, []),
                 'pending': version.revision.status == VERSION_STATUS_NEED_ATTENTION,
-            }
-            for version in Version.objects.filter(
-                object_id=object_id,
-                content_type=self.content_type
-            ).select_related('revision', 'revision__changed_by', 'revision__moderated_by')
-        ]
+            })
+            action_list.append(action)
         context = {
-            'action_list': action_list
-            , 'is_admin': is_user_content_admin(request.user)
+            'action_list': action_list,
+            'page': page,
+            'page_var': PAGE_VAR,
+            'is_admin': is_user_content_admin(request.user),
         }
         context.update(extra_context or {})
         return super(WorkflowAdmin, self).history_view(request, object_id, context)
 
+    def get_history_page(self, request, versions):
+        """Returns the requested page of object's versions."""
+        paginator = Paginator(versions, self.history_per_page)
+        try:
+            return paginator.page(request.GET.get(PAGE_VAR, 1))
+        except PageNotAnInteger:
+            return paginator.page(1)
+        except EmptyPage:
+            return paginator.page(paginator.num_pages)
+
     def render_version_form(self, request, version, form_template, extra_context, editing=False, recovering=False):
         obj = version.object_version.object
         object_id = obj.pk
@@ -551,17 +581,17 @@ class WorkflowAdmin(admin.ModelAdmin):
     def version_changes_view(self, request, object_id, version_id, extra_context=None):
         version = get_object_or_404(Version, pk=version_id)
         parent = version.revision.parent
+        changes = {}
         if parent is not None and not parent.deleted:
-            new_object = version.object_version.object
-            old_object = parent.version(new_object.id, self.content_type).object_version.object
-            changes = changes_between_models(
-                old_object, new_object).values()
-        else:
-            changes = {}
+            parent_version = parent.version(version.object_id, self.content_type)
+            parent_version.revision = parent
+            changes = get_changes(version, parent_version)
         context = {
             'title': _("Viewing changes of %(name)s") % {'name': version.object_repr},
             'change_status_only': True,
-            'changes': changes,
+            'changes': changes.get('fields', []),
+            'm2m_changes': changes.get('m2m', []),
+            'child_changes': changes.get('children', []),
         }
         context.update(extra_context or {})
         return self.render_version_form(request, version, self.view_changes_form_template, context)
@@ -586,9 +616,10 @@ class WorkflowAdmin(admin.ModelAdmin):
         return self.version_status_change_view(request, object_id, version_id, VERSION_STATUS_REJECTED, extra_context)
 
     def put_content_permissions(self, request, context):
-        current_user = request.user
-        context['has_content_manager_permission'] = is_user_content_manager(current_user)
-        context['has_content_admin_permission'] = is_user_content_admin(current_user)
+        roles = get_user_roles(request.user)
+        context['workflow_roles'] = roles
+        context['has_content_manager_permission'] = roles.is_content_manager
+        context['has_content_admin_permission'] = roles.is_content_admin
 
     def put_can_be_branched(self, request, object_id, context, version=None):
         has_children, can_be_branched = Version.objects.children_info(
@@ -821,32 +852,97 @@ class WorkflowAdmin(admin.ModelAdmin):
 class VersionAdmin(admin.ModelAdmin):
     changelist_view_template = "workflow/version_change_list.html"
 
+    # Query parameters used to filter the moderation queue.
+    content_type_var = 'content_type'
+    created_by_var = 'created_by'
+    age_var = 'age'
+
+    # Choices of minimal age of pending versions, in days.
+    age_choices = (1, 7, 30)
+
     @csrf_protect_m
     def changelist_view(self, request, extra_context=None):
-        action_list = []
-
-        for version in Version.objects.filter(
+        pending = Version.objects.filter(
             revision__status=VERSION_STATUS_NEED_ATTENTION,
-        ).select_related('revision', 'revision__created_by'):
-            url_params = (version.object_id, version.id, self.admin_site.name, version.object_version.object._meta)
-            try:
-                action_list.append({
-                    'version': version,
-                    'edit_url': version_edit_url(*url_params),
-                    'view_url': version_view_changes_url(*url_params),
-                    'approve_url': version_approve_url(*url_params),
-                    'reject_url': version_reject_url(*url_params),
-                })
-            except:
-                pass
+        )
+        filters = self.get_queue_filters(request)
+        versions = pending.filter(**filters).select_related(
+            'revision', 'revision__created_by'
+        ).defer('serialized_data')
+        paginator = Paginator(versions, self.list_per_page)
+        try:
+            page = paginator.page(request.GET.get(PAGE_VAR, 1))
+        except PageNotAnInteger:
+            page = paginator.page(1)
+        except EmptyPage:
+            page = paginator.page(paginator.num_pages)
+
+        action_list = []
+        url_builders = {}
+        for version in page.object_list:
+            if version.content_type_id not in url_builders:
+                url_builders[version.content_type_id] = self.get_url_builders(version.content_type_id)
+            action = {'version': version}
+            builders = url_builders[version.content_type_id]
+            if builders is not None:
+                action.update(
+                    (name, build(version.object_id, version.id))
+                    for name, build in builders.items())
+            action_list.append(action)
+
+        content_type_ids = pending.order_by().values_list(
+            'content_type', flat=True).distinct()
+        query = request.GET.copy()
+        query.pop(PAGE_VAR, None)
         context = {
             'title': force_unicode(self.model._meta.verbose_name_plural),
             'action_list': action_list,
+            'page': page,
+            'page_var': PAGE_VAR,
+            'query_string': query.urlencode(),
+            'content_type_var': self.content_type_var,
+            'created_by_var': self.created_by_var,
+            'age_var': self.age_var,
+            'content_types': ContentType.objects.filter(pk__in=list(content_type_ids)),
+            'authors': User.objects.filter(
+                created_by_set__status=VERSION_STATUS_NEED_ATTENTION).distinct(),
+            'age_choices': self.age_choices,
+            'selected_content_type': request.GET.get(self.content_type_var, ''),
+            'selected_created_by': request.GET.get(self.created_by_var, ''),
+            'selected_age': request.GET.get(self.age_var, ''),
         }
         context.update(extra_context or {})
         return render_to_response(
             self.changelist_view_template, context, template.RequestContext(request))
 
+    def get_queue_filters(self, request):
+        """Returns lookups filtering pending versions by request parameters."""
+        filters = {}
+        try:
+            if request.GET.get(self.content_type_var):
+                filters['content_type'] = int(request.GET[self.content_type_var])
+            if request.GET.get(self.created_by_var):
+                filters['revision__created_by'] = int(request.GET[self.created_by_var])
+            if request.GET.get(self.age_var):
+                filters['revision__date_created__lte'] = (datetime.datetime.now()
+                    - datetime.timedelta(days=int(request.GET[self.age_var])))
+        except ValueError:
+            raise Http404(_("Invalid filter value."))
+        return filters
+
+    def get_url_builders(self, content_type_id):
+        """
+        Returns url builders of version actions for the given content type,
+        or None if its model is not managed by the admin site.
+        """
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            return None
+        try:
+            return version_url_builders(self.admin_site.name, model._meta)
+        except NoReverseMatch:
+            return None
+
     @csrf_protect_m
     @transaction.commit_on_success
     def delete_view(self, request, object_id, extra_context=None):
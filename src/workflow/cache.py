@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Process-level caches used by workflow."""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from threading import Lock
+
+from workflow.settings import WORKFLOW_VERSION_CACHE_SIZE
+
+
+class LRUCache(object):
+    """
+    A thread-safe cache of limited size which evicts least recently used
+    entries first and counts hits and misses.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value for the given key or default."""
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # Move the entry to the most recently used end.
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Caches the value, evicting least recently used entries if full."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Removes the given key from the cache."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes all entries and resets counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns a dict with cache size and hit/miss counters."""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+# Deserialized versions keyed by (version pk, digest), or None if disabled.
+version_cache = LRUCache(WORKFLOW_VERSION_CACHE_SIZE) if WORKFLOW_VERSION_CACHE_SIZE else None
@@ -5,10 +5,16 @@ import re
 import difflib
 import logging
 
+from django.contrib.contenttypes.generic import GenericRelation
+from django.contrib.contenttypes.models import ContentType
 from django.db.models import fields
-from django.utils.html import escape
+from django.utils.encoding import force_text
 from django.utils.translation import ugettext as _
 
+from workflow import textdiff
+from workflow.constants import VERSION_TYPE_DELETE
+from workflow.settings import WORKFLOW_DIFF_ENGINE
+
 LOG = logging.getLogger(__name__)
 
 
@@ -28,58 +34,109 @@ class BaseChange(object):
 
         return render_to_string(template, context)
 
-
-class TextChange(BaseChange):
+    def has_changes(self):
+        """Tests whether values differ, without rendering the diff."""
+        return self.change[0] != self.change[1]
 
     @property
     def diff(self):
-        value1, value2 = escape(self.change[0]), escape(self.change[1])
-        if value1 == value2:
-            return None
+        """Rendered diff, or None if values don't differ. Rendered once."""
+        if not hasattr(self, '_diff_cache'):
+            self._diff_cache = self.render() if self.has_changes() else None
+        return self._diff_cache
+
+
+class TextChange(BaseChange):
+
+    def __init__(self, verbose_name, field, change, engine=None):
+        super(TextChange, self).__init__(verbose_name, field, change)
+        self.engine = engine or WORKFLOW_DIFF_ENGINE
+
+    def render(self):
+        try:
+            diff_operations = DIFF_ENGINES[self.engine](*self.change)
+        except textdiff.DiffTooLarge:
+            return self.render_diff(
+                'workflow/large_diff.html',
+                    {'left_length': len(self.change[0]),
+                     'right_length': len(self.change[1])})
         return self.render_diff(
             'workflow/html_diff.html',
-                {'diff_operations': get_diff_operations(*self.change)})
+                {'diff_operations': diff_operations})
 
 
 class ImageChange(BaseChange):
 
-    @property
-    def diff(self):
+    def has_changes(self):
+        left_image, right_image = self.change
+        return left_image.name != right_image.name
+
+    def render(self):
         left_image, right_image = self.change
-        if (left_image.url == right_image.url):
-            return None
         return self.render_diff(
             'workflow/image_diff.html',
                 {'left_image': left_image,
                  'right_image': right_image})
 
 
-def get_change(model1, model2, field):
+class DiffField(object):
+    """Diff metadata of a model field."""
+
+    def __init__(self, model, field):
+        self.field = field
+        self.name = field.name
+        self.key = u"%s__%s" % (model.__name__.lower(), field.name)
+        # Fields with choices are compared by their display values.
+        self.display_getter = "get_%s_display" % field.name if field.choices else None
+
+    def get_change(self, model1, model2, value1, value2, engine=None):
+        if self.display_getter:
+            value1 = getattr(model1, self.display_getter)()
+            value2 = getattr(model2, self.display_getter)()
+        return get_change_for_type(self.field.verbose_name, (value1, value2), self.field, engine)
+
+
+_diff_fields_cache = {}
+
+
+def get_diff_fields(model):
+    """Returns a list of DiffField of the model, built once per model."""
     try:
-        value1 = getattr(model1, "get_%s_display" % field.name)()
-        value2 = getattr(model2, "get_%s_display" % field.name)()
-    except AttributeError:
-        value1 = field.value_from_object(model1)
-        value2 = field.value_from_object(model2)
-
-    change = get_change_for_type(
-        field.verbose_name,
-        (value1, value2),
-        field
-    )
-    return change
+        return _diff_fields_cache[model]
+    except KeyError:
+        diff_fields = [
+            DiffField(model, field) for field in model._meta.fields
+            if not isinstance(field, fields.AutoField)]
+        _diff_fields_cache[model] = diff_fields
+        return diff_fields
+
+
+def get_change(model1, model2, field):
+    return DiffField(model1.__class__, field).get_change(
+        model1, model2, field.value_from_object(model1), field.value_from_object(model2))
+
 
+def changes_between_models(model1, model2, excludes=[], engines={}):
+    """
+    Returns a dict of changes of fields which differ between the models.
 
-def changes_between_models(model1, model2, excludes=[]):
+    Raw field values are compared first, changes are only built for fields
+    whose values differ and their diffs are rendered on first access.
+    `engines` maps field names to names of DIFF_ENGINES text fields are
+    diffed with, others use WORKFLOW_DIFF_ENGINE setting.
+    """
     changes = {}
-    for field in model1._meta.fields:
-        if not (isinstance(field, (fields.AutoField,))):
-            if field.name in excludes:
-                continue
-            name = u"%s__%s" % (model1.__class__.__name__.lower(), field.name)
-            change = get_change(model1, model2, field)
-            if change.diff:
-                changes[name] = change
+    for diff_field in get_diff_fields(model1.__class__):
+        if diff_field.name in excludes:
+            continue
+        value1 = diff_field.field.value_from_object(model1)
+        value2 = diff_field.field.value_from_object(model2)
+        if value1 == value2:
+            continue
+        change = diff_field.get_change(
+            model1, model2, value1, value2, engines.get(diff_field.name))
+        if change.has_changes():
+            changes[diff_field.key] = change
     return changes
 
 
@@ -100,16 +157,38 @@ def get_diff_operations(a, b):
     return operations
 
 
-def html_to_list(html):
-    pattern = re.compile(r'&.*?;|(?:<[^<]*?>)|'\
-                         '(?:\w[\w-]*[ ]*)|(?:<[^<]*?>)|'\
-                         '(?:\s*[,\.\?]*)', re.UNICODE)
+# Functions returning diff operations of two texts, by engine name.
+DIFF_ENGINES = {
+    'difflib': get_diff_operations,
+    'myers': textdiff.get_diff_operations,
+    'html': textdiff.get_html_diff_operations,
+}
+
+# Diff engines of fields of models with a WorkflowAdmin: {model: {field name: engine}}.
+_model_engines = {}
+
+
+def register_diff_engines(model, engines):
+    """Sets diff engines of fields of the model, see WorkflowAdmin.diff_engines."""
+    _model_engines[model] = dict(engines)
+
+
+def get_diff_engines(model):
+    """Returns diff engines of fields of the model by field name."""
+    return _model_engines.get(model, {})
 
-    return [''.join(element) for element in filter(None,
-                                                   pattern.findall(html))]
 
+def get_engine_models():
+    """Returns models whose diff engines were registered, i.e. models with a WorkflowAdmin."""
+    return list(_model_engines)
 
-def get_change_for_type(verbose_name, change, field):
+
+def html_to_list(html):
+    """Returns a list of tags, entities, words and punctuation of the HTML."""
+    return textdiff.tokenize_html(html)
+
+
+def get_change_for_type(verbose_name, change, field, engine=None):
     if isinstance(field, fields.files.ImageField):
         change = ImageChange(
             u"Current %(verbose_name)s / "\
@@ -120,6 +199,7 @@ def get_change_for_type(verbose_name, change, field):
         value1, value2 = change
         change = TextChange(verbose_name, field,
             (unicode(value1), unicode(value2)),
+            engine,
         )
     return change
 
@@ -130,3 +210,163 @@ def comment_from_changes(changes={}):
         ) % ", ".join(unicode(change.verbose_name) for change in changes.values())
     else:
         return _(u"Изменений нет.")
+
+
+class M2MChange(object):
+    """Primary keys added to and removed from a many-to-many field."""
+
+    def __init__(self, verbose_name, added, removed):
+        self.verbose_name = verbose_name
+        self.added = sorted(added)
+        self.removed = sorted(removed)
+
+
+class VersionChanges(object):
+    """
+    Changes of an object between its version in a parent revision and in
+    a revision. The old version is None if the object was added, the new
+    one if the object was removed.
+    """
+
+    ADDED = 'added'
+    REMOVED = 'removed'
+    CHANGED = 'changed'
+
+    def __init__(self, old_version, new_version):
+        self.old_version = old_version
+        self.new_version = new_version
+
+    @property
+    def version(self):
+        return self.new_version or self.old_version
+
+    @property
+    def status(self):
+        if not _exists(self.new_version):
+            return self.REMOVED
+        if not _exists(self.old_version):
+            return self.ADDED
+        return self.CHANGED
+
+    @property
+    def model(self):
+        return ContentType.objects.get_for_id(self.version.content_type_id).model_class()
+
+    @property
+    def verbose_name(self):
+        return self.model._meta.verbose_name
+
+    @property
+    def fields(self):
+        """Changes of fields of a changed object, see changes_between_models()."""
+        if not hasattr(self, '_fields_cache'):
+            if self.status == self.CHANGED:
+                changes = changes_between_models(
+                    self.old_version.object_version.object,
+                    self.new_version.object_version.object,
+                    engines=get_diff_engines(self.model))
+                self._fields_cache = list(changes.values())
+            else:
+                self._fields_cache = []
+        return self._fields_cache
+
+    @property
+    def m2m(self):
+        """A list of M2MChange of many-to-many fields of a changed object."""
+        if not hasattr(self, '_m2m_cache'):
+            self._m2m_cache = []
+            if self.status == self.CHANGED:
+                old_data = self.old_version.object_version.m2m_data
+                new_data = self.new_version.object_version.m2m_data
+                opts = self.model._meta
+                for name in sorted(set(old_data) | set(new_data)):
+                    old_pks = set(force_text(pk) for pk in old_data.get(name, ()))
+                    new_pks = set(force_text(pk) for pk in new_data.get(name, ()))
+                    if old_pks != new_pks:
+                        self._m2m_cache.append(M2MChange(
+                            opts.get_field(name).verbose_name,
+                            new_pks - old_pks,
+                            old_pks - new_pks))
+        return self._m2m_cache
+
+
+def _exists(version):
+    return version is not None and version.object_type != VERSION_TYPE_DELETE
+
+
+def changes_between_revisions(old_revision, new_revision, keys=None):
+    """
+    Returns a list of VersionChanges of objects added, removed or changed
+    between the revisions, ordered by content type and object id. If
+    `keys` are given, only objects with these (content_type_id, object_id)
+    keys are compared.
+
+    Versions of both revisions are fetched with one query per revision and
+    matched by (content_type_id, object_id). Versions with equal digests
+    are skipped without being deserialized, versions saved before digests
+    were introduced have none and are always compared. Delta versions
+    based on the version of the old revision get it without a query.
+    """
+    old_versions = old_revision.get_version_index()
+    new_versions = new_revision.get_version_index()
+    if keys is None:
+        keys = set(old_versions) | set(new_versions)
+    changes = []
+    for key in keys:
+        old_version = old_versions.get(key)
+        new_version = new_versions.get(key)
+        if not _exists(old_version) and not _exists(new_version):
+            continue
+        if old_version is not None and new_version is not None:
+            if (old_version.digest and old_version.digest == new_version.digest
+                    and _exists(old_version) == _exists(new_version)):
+                continue
+            if new_version.base_version_id == old_version.pk:
+                new_version.base_version = old_version
+        changes.append((key, VersionChanges(old_version, new_version)))
+    changes.sort(key=lambda change: change[0])
+    return [change for key, change in changes]
+
+
+def get_child_relations(model, follow):
+    """
+    Returns relations of the model's followed relationships which refer
+    back to it, i.e. of inline objects: a list of (child model, name of
+    the field referring to the object, name of the content type field of
+    generic relations or None) tuples.
+    """
+    related_objects = dict(
+        (related.get_accessor_name(), related)
+        for related in model._meta.get_all_related_objects())
+    generic_relations = dict(
+        (field.name, field) for field in model._meta.many_to_many
+        if isinstance(field, GenericRelation))
+    relations = []
+    for name in follow:
+        if name in related_objects:
+            related = related_objects[name]
+            relations.append((related.model, related.field.name, None))
+        elif name in generic_relations:
+            field = generic_relations[name]
+            relations.append(
+                (field.rel.to, field.object_id_field_name, field.content_type_field_name))
+    return relations
+
+
+def get_child_keys(revisions, model, object_id, follow):
+    """
+    Returns (content_type_id, object_id) keys of versions in any of the
+    revisions of inline objects of the given object, see
+    get_child_relations().
+    """
+    content_type_id = force_text(ContentType.objects.get_for_model(model).id)
+    keys = set()
+    for child_model, field_name, content_type_field_name in get_child_relations(model, follow):
+        child_content_type_id = ContentType.objects.get_for_model(child_model).id
+        for revision in revisions:
+            index = revision.get_related_version_index(child_model, field_name)
+            for version in index.get(force_text(object_id), {}).values():
+                if (content_type_field_name is None or
+                        force_text(version.field_dict.get(content_type_field_name)) == content_type_id):
+                    keys.add((child_content_type_id, version.object_id))
+    return keys
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of rendered changes between versions and versions of the same
+objects in parent revisions.
+
+Changes shown on the changes page of WorkflowAdmin are stored in the
+Django cache if WORKFLOW_DIFF_CACHE_TIMEOUT setting is not None. They are
+rendered when a revision is saved, so opening the page is a lookup.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import logging
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.utils.encoding import force_bytes, force_text
+
+from workflow.diff import (
+    changes_between_revisions, get_child_keys, get_diff_engines, get_engine_models)
+from workflow.models import post_revision_commit
+from workflow.revisions import RevisionManager, RegistrationError
+from workflow.settings import WORKFLOW_DIFF_ENGINE, WORKFLOW_DIFF_CACHE_TIMEOUT
+
+LOG = logging.getLogger(__name__)
+
+DIFF_CACHE_KEY = "workflow:diff:{version_id}:{parent_version_id}:{engine_version}"
+
+# Version of rendered diffs, increase it when diff engines or templates
+# change so diffs cached before are not used.
+DIFF_ENGINE_VERSION = 2
+
+
+def get_engine_version(model):
+    """Returns a string which changes whenever diffs of the model would render differently."""
+    engines = sorted(get_diff_engines(model).items())
+    digest = hashlib.sha1(force_bytes("{0}:{1!r}".format(WORKFLOW_DIFF_ENGINE, engines))).hexdigest()
+    return "{0}.{1}".format(DIFF_ENGINE_VERSION, digest[:8])
+
+
+def _render_fields(version_changes):
+    return [
+        {'verbose_name': force_text(change.verbose_name), 'diff': change.diff}
+        for change in version_changes.fields]
+
+
+def _render_m2m(version_changes):
+    return [
+        {'verbose_name': force_text(change.verbose_name),
+         'added': change.added,
+         'removed': change.removed}
+        for change in version_changes.m2m]
+
+
+def _get_follow(revision, model):
+    """Returns relationships followed from the model by the revision's manager."""
+    try:
+        return RevisionManager.get_manager(revision.manager_slug).get_adapter(model).follow
+    except RegistrationError:
+        return ()
+
+
+def render_changes(version, parent_version):
+    """
+    Returns changes between the object of the parent version and of the
+    version, and of its inline objects between the revisions of the
+    versions, as a dict of:
+
+        fields: a list of dicts with verbose_name and rendered diff of
+            changed fields,
+        m2m: a list of dicts with verbose_name, added and removed primary
+            keys of changed many-to-many fields,
+        children: a list of dicts with verbose_name, object_repr, status,
+            fields and m2m of added, removed or changed inline objects.
+
+    Versions of both revisions are fetched with one query per revision.
+    """
+    revision = version.revision
+    parent = parent_version.revision
+    parent.get_version_index()
+    revision.get_version_index()
+    model = ContentType.objects.get_for_id(version.content_type_id).model_class()
+    key = (version.content_type_id, version.object_id)
+    keys = get_child_keys((parent, revision), model, version.object_id, _get_follow(revision, model))
+    keys.add(key)
+    changes = {'fields': [], 'm2m': [], 'children': []}
+    for version_changes in changes_between_revisions(parent, revision, keys):
+        if (version_changes.version.content_type_id, version_changes.version.object_id) == key:
+            changes['fields'] = _render_fields(version_changes)
+            changes['m2m'] = _render_m2m(version_changes)
+        else:
+            changes['children'].append({
+                'verbose_name': force_text(version_changes.verbose_name),
+                'object_repr': version_changes.version.object_repr,
+                'status': version_changes.status,
+                'fields': _render_fields(version_changes),
+                'm2m': _render_m2m(version_changes),
+            })
+    return changes
+
+
+def _get_cache_key(version, parent_version):
+    model = ContentType.objects.get_for_id(version.content_type_id).model_class()
+    return DIFF_CACHE_KEY.format(
+        version_id=version.pk,
+        parent_version_id=parent_version.pk,
+        engine_version=get_engine_version(model))
+
+
+def get_changes(version, parent_version):
+    """
+    Returns changes of render_changes(), from the Django cache if they
+    were cached.
+    """
+    if WORKFLOW_DIFF_CACHE_TIMEOUT is None:
+        return render_changes(version, parent_version)
+    cache_key = _get_cache_key(version, parent_version)
+    changes = cache.get(cache_key)
+    if changes is None:
+        changes = render_changes(version, parent_version)
+        cache.set(cache_key, changes, WORKFLOW_DIFF_CACHE_TIMEOUT)
+    return changes
+
+
+def cache_changes(pairs):
+    """Renders and caches changes of the given (version, parent version) pairs."""
+    cache.set_many(
+        dict((_get_cache_key(version, parent_version), render_changes(version, parent_version))
+             for version, parent_version in pairs),
+        WORKFLOW_DIFF_CACHE_TIMEOUT)
+
+
+def _post_revision_commit_receiver(revision, versions, **kwargs):
+    """
+    Caches changes of versions of models with a WorkflowAdmin in a new
+    revision. Changes are rendered while the revision is saved, from the
+    versions just saved, since they are not visible to other connections
+    before the transaction is committed.
+    """
+    parent = revision.parent
+    if WORKFLOW_DIFF_CACHE_TIMEOUT is None or parent is None or parent.deleted:
+        return
+    content_type_ids = set(
+        ContentType.objects.get_for_model(model).pk for model in get_engine_models())
+    versions = [
+        version for version in versions if version.content_type_id in content_type_ids]
+    if not versions:
+        return
+    parent_versions = parent.get_version_index()
+    pairs = [
+        (version, parent_versions[(version.content_type_id, version.object_id)])
+        for version in versions
+        if (version.content_type_id, version.object_id) in parent_versions]
+    try:
+        cache_changes(pairs)
+    except Exception:
+        LOG.exception("Failed to cache changes of versions")
+
+post_revision_commit.connect(_post_revision_commit_receiver)
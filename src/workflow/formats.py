@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Serialization formats of versions.
+
+A format turns a model instance into the text stored in
+`Version.serialized_data` and back. Formats are looked up by the name
+recorded in `Version.format`, names of Django serializers which are not
+registered here (e.g. "json" of versions saved before formats were
+introduced) are handled by Django serialization framework.
+
+Compressed data is stored under the format name with a compression
+suffix, e.g. "compact-json+zlib".
+
+Formats which support records can convert their data to a dict of Django
+"python" serialization format, {"model": ..., "pk": ..., "fields": {...}},
+so versions can be stored as deltas between records.
+"""
+from __future__ import unicode_literals
+
+import base64
+import json
+import zlib
+
+from threading import Lock
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+from django.core import serializers
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, IntegrityError
+from django.utils.encoding import force_text, force_bytes
+
+from workflow.settings import WORKFLOW_COMPRESSION, WORKFLOW_COMPRESSION_LEVEL
+
+
+class VersionFormat(object):
+    """Base class of version serialization formats."""
+
+    # The name recorded in Version.format.
+    name = None
+
+    # Whether the data can be converted to a record, see to_record().
+    supports_records = False
+
+    # Whether the data is a delta which is applied to a record of a base version.
+    is_delta = False
+
+    def serialize(self, obj, fields):
+        """Returns a string of serialized data of the given fields of obj."""
+        raise NotImplementedError
+
+    def deserialize(self, data, db):
+        """Returns a DeserializedObject of the given serialized data."""
+        raise NotImplementedError
+
+    def to_record(self, data, db):
+        """Returns a record of Django "python" serialization format of the data."""
+        raise NotImplementedError
+
+    def prepare_save(self, data, db):
+        """Called with serialized data in this format before versions are saved."""
+        pass
+
+    def encode(self, data):
+        """Returns the serialized data in the form it is stored in."""
+        return data
+
+    def decode(self, data):
+        """Returns the serialized data from the form it is stored in."""
+        return data
+
+
+class DjangoFormat(VersionFormat):
+    """A format backed by a Django serializer, e.g. "json" or "xml"."""
+
+    def __init__(self, name):
+        self.name = name
+        self.supports_records = name == "json"
+
+    def serialize(self, obj, fields):
+        return serializers.serialize(self.name, (obj,), fields=fields)
+
+    def deserialize(self, data, db):
+        return list(serializers.deserialize(
+            self.name, data, using=db, ignorenonexistent=True))[0]
+
+    def to_record(self, data, db):
+        if not self.supports_records:
+            raise NotImplementedError("{0!r} format does not support records".format(self.name))
+        return json.loads(data)[0]
+
+
+class CompactJSONFormat(VersionFormat):
+    """
+    A compact JSON format which stores field values without field names.
+
+    Serialized data is a JSON list: [schema digest, pk, value, value, ...].
+    Field names are stored once per model in FieldSchema table and values
+    are converted back to Python with Django "python" deserializer.
+    """
+
+    name = "compact-json"
+
+    supports_records = True
+
+    def __init__(self):
+        # Schemas known to this process: {digest: (model label, field names)}.
+        self._schemas = {}
+        self._lock = Lock()
+
+    def get_schema_digest(self, data):
+        """Returns the schema digest the serialized data starts with."""
+        # Data always starts with '["' followed by the 40 characters digest.
+        return data[2:42]
+
+    def serialize(self, obj, fields):
+        record = serializers.serialize("python", (obj,), fields=fields)[0]
+        values = record["fields"]
+        opts = obj._meta.concrete_model._meta
+        names = [
+            field.name for field in opts.local_fields + opts.local_many_to_many
+            if field.name in values]
+        digest = self.add_schema(record["model"], names)
+        return force_text(json.dumps(
+            [digest, record["pk"]] + [values[name] for name in names],
+            cls = DjangoJSONEncoder,
+            separators = (",", ":"),
+            ensure_ascii = False,
+        ))
+
+    def add_schema(self, model, names):
+        """Remembers a schema of the given model and field names, returns its digest."""
+        from workflow.models import get_digest
+        digest = get_digest("{model}:{fields}".format(model=model, fields=",".join(names)))
+        if digest not in self._schemas:
+            with self._lock:
+                self._schemas[digest] = (model, names)
+        return digest
+
+    def get_schema(self, digest, db):
+        """Returns (model label, field names) of the schema with the given digest."""
+        from workflow.models import FieldSchema
+        try:
+            return self._schemas[digest]
+        except KeyError:
+            schema = FieldSchema.objects.using(db).get(digest=digest)
+            with self._lock:
+                self._schemas[digest] = (schema.model, schema.get_field_names())
+            return self._schemas[digest]
+
+    def to_record(self, data, db):
+        payload = json.loads(data)
+        model, names = self.get_schema(payload[0], db)
+        return {
+            "model": model,
+            "pk": payload[1],
+            "fields": dict(zip(names, payload[2:])),
+        }
+
+    def deserialize(self, data, db):
+        return deserialize_record(self.to_record(data, db), db)
+
+    def prepare_save(self, data, db):
+        """
+        Saves schemas of the given serialized data which are not in the
+        database yet. Every schema is inserted in its own savepoint, so a
+        schema inserted concurrently by another process is skipped.
+        """
+        from workflow.models import FieldSchema
+        digests = set(self.get_schema_digest(serialized_data) for serialized_data in data)
+        digests.difference_update(FieldSchema.objects.using(db).filter(
+            digest__in=digests).values_list("digest", flat=True))
+        for digest in digests:
+            sid = transaction.savepoint(using=db)
+            try:
+                FieldSchema.objects.using(db).create(
+                    digest=digest,
+                    model=self._schemas[digest][0],
+                    fields=",".join(self._schemas[digest][1]))
+            except IntegrityError:
+                transaction.savepoint_rollback(sid, using=db)
+            else:
+                transaction.savepoint_commit(sid, using=db)
+
+
+class DeltaFormat(VersionFormat):
+    """
+    Fields of a record which differ from the record of a base version.
+
+    Serialized data is a JSON list: [{field name: value}, [removed field names]].
+    Delta data can't be deserialized on its own, use apply() with the
+    record of the base version instead.
+    """
+
+    name = "delta"
+
+    is_delta = True
+
+    def diff(self, base_record, record):
+        """
+        Returns delta data which turns the base record into the given one,
+        or None if records are of different objects. The data is not
+        encoded yet, see encode().
+        """
+        if base_record["model"] != record["model"] or base_record["pk"] != record["pk"]:
+            return None
+        base_fields = base_record["fields"]
+        changed = dict(
+            (name, value) for name, value in record["fields"].items()
+            if name not in base_fields or base_fields[name] != value)
+        removed = [name for name in base_fields if name not in record["fields"]]
+        return force_text(json.dumps(
+            [changed, removed],
+            cls = DjangoJSONEncoder,
+            separators = (",", ":"),
+            ensure_ascii = False,
+        ))
+
+    def apply(self, base_record, data):
+        """Returns a new record made of the base record and the delta data."""
+        changed, removed = json.loads(data)
+        fields = dict(base_record["fields"])
+        fields.update(changed)
+        for name in removed:
+            fields.pop(name, None)
+        return {
+            "model": base_record["model"],
+            "pk": base_record["pk"],
+            "fields": fields,
+        }
+
+    def deserialize(self, data, db):
+        raise NotImplementedError("Delta data is deserialized with the record of its base version")
+
+
+# Compression codecs: {name: (compress(data, level), decompress(data))}.
+COMPRESSIONS = {
+    "zlib": (zlib.compress, zlib.decompress),
+}
+if lzma is not None:
+    COMPRESSIONS["lzma"] = (
+        lambda data, level: lzma.compress(data, preset=level),
+        lzma.decompress)
+
+
+class CompressedFormat(VersionFormat):
+    """
+    A format which stores data of another format compressed and encoded
+    with base64, so it fits a text column.
+    """
+
+    def __init__(self, base, compression, level=WORKFLOW_COMPRESSION_LEVEL):
+        if compression not in COMPRESSIONS:
+            raise ImproperlyConfigured("Unknown or unavailable compression {0!r}, choose from: {1}".format(
+                compression, ", ".join(sorted(COMPRESSIONS))))
+        self.base = base
+        self.compression = compression
+        self.level = level
+        self.name = "{base}+{compression}".format(base=base.name, compression=compression)
+
+    def encode(self, data):
+        compress = COMPRESSIONS[self.compression][0]
+        return force_text(base64.b64encode(compress(force_bytes(data), self.level)))
+
+    def decode(self, data):
+        decompress = COMPRESSIONS[self.compression][1]
+        return force_text(decompress(base64.b64decode(force_bytes(data))))
+
+    @property
+    def supports_records(self):
+        return self.base.supports_records
+
+    @property
+    def is_delta(self):
+        return self.base.is_delta
+
+    def serialize(self, obj, fields):
+        return self.encode(self.base.serialize(obj, fields))
+
+    def deserialize(self, data, db):
+        return self.base.deserialize(self.decode(data), db)
+
+    def to_record(self, data, db):
+        return self.base.to_record(self.decode(data), db)
+
+    def diff(self, base_record, record):
+        return self.base.diff(base_record, record)
+
+    def apply(self, base_record, data):
+        return self.base.apply(base_record, self.decode(data))
+
+    def prepare_save(self, data, db):
+        self.base.prepare_save([self.decode(serialized_data) for serialized_data in data], db)
+
+
+def deserialize_record(record, db):
+    """Returns a DeserializedObject of the given record."""
+    return list(serializers.deserialize(
+        "python", [record], using=db, ignorenonexistent=True))[0]
+
+
+def dump_record(record):
+    """Returns the record serialized in Django "json" format."""
+    return force_text(json.dumps([record], cls=DjangoJSONEncoder))
+
+
+_formats = {}
+
+
+def register_format(version_format):
+    """Registers a version format under its name."""
+    _formats[version_format.name] = version_format
+
+
+def get_format(name):
+    """
+    Returns the version format with the given name. Unregistered names are
+    treated as names of Django serializers.
+    """
+    try:
+        return _formats[name]
+    except KeyError:
+        pass
+    if "+" in name:
+        base, compression = name.rsplit("+", 1)
+        version_format = CompressedFormat(get_format(base), compression)
+        _formats[name] = version_format
+        return version_format
+    return DjangoFormat(name)
+
+
+def get_storage_format(name, compression=WORKFLOW_COMPRESSION):
+    """
+    Returns the format new versions serialized in the named format are
+    stored in: the format itself or its compressed variant.
+    """
+    if not compression:
+        return get_format(name)
+    return get_format("{name}+{compression}".format(name=name, compression=compression))
+
+
+def get_format_names():
+    """Returns names of registered uncompressed formats of whole objects."""
+    return sorted(
+        name for name, version_format in _formats.items()
+        if "+" not in name and not version_format.is_delta)
+
+
+register_format(DjangoFormat("json"))
+register_format(CompactJSONFormat())
+register_format(DeltaFormat())
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Module contains backfill_digests management command.
+"""
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction, DEFAULT_DB_ALIAS
+
+from workflow.formats import get_format, dump_record
+from workflow.models import Revision, Version, get_digest, get_revision_digest
+
+
+class Command(BaseCommand):
+    """
+    A management command which computes digests of versions and revisions
+    saved before digests were introduced.
+    """
+
+    help = "Compute missing digests of versions and revisions"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--database",
+            action="store",
+            dest="database",
+            default=DEFAULT_DB_ALIAS,
+            help="Nominates a database to backfill digests in."),
+        make_option("--batch-size",
+            action="store",
+            dest="batch_size",
+            type="int",
+            default=1000,
+            help="Number of rows updated per transaction."),
+    )
+
+    def handle(self, *args, **options):
+        db = options["database"]
+        batch_size = options["batch_size"]
+        count = self.backfill_versions(db, batch_size)
+        self.stdout.write("Computed digests of {count} versions.\n".format(count=count))
+        count = self.backfill_revisions(db, batch_size)
+        self.stdout.write("Computed digests of {count} revisions.\n".format(count=count))
+
+    def backfill_versions(self, db, batch_size):
+        versions = Version.objects.using(db).filter(digest="").order_by("pk")
+        count = 0
+        last_pk = 0
+        while True:
+            batch = list(versions.filter(pk__gt=last_pk).values_list(
+                "pk", "format", "serialized_data")[:batch_size])
+            if not batch:
+                return count
+            with transaction.commit_on_success(using=db):
+                # Digests are computed from uncompressed data, deltas are
+                # resolved to the record they stand for first.
+                for pk, format_name, serialized_data in batch:
+                    version_format = get_format(format_name)
+                    if version_format.is_delta:
+                        data = dump_record(Version.objects.using(db).get(pk=pk).get_record())
+                    else:
+                        data = version_format.decode(serialized_data)
+                    Version.objects.using(db).filter(pk=pk).update(digest=get_digest(data))
+            count += len(batch)
+            last_pk = batch[-1][0]
+
+    def backfill_revisions(self, db, batch_size):
+        versions = Version.objects.using(db).filter(
+            revision__digest="",
+        ).order_by("revision").values_list("revision", "digest").iterator()
+        count = 0
+        digests = {}
+        for revision_id, digest in versions:
+            if revision_id not in digests and len(digests) >= batch_size:
+                self.update_revisions(digests, db)
+                count += len(digests)
+                digests = {}
+            digests.setdefault(revision_id, []).append(digest)
+        self.update_revisions(digests, db)
+        return count + len(digests)
+
+    def update_revisions(self, digests, db):
+        with transaction.commit_on_success(using=db):
+            for revision_id, version_digests in digests.items():
+                Revision.objects.using(db).filter(pk=revision_id).update(
+                    digest=get_revision_digest(version_digests))
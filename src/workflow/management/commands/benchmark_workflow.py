@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Module contains benchmark_workflow management command.
+"""
+from __future__ import unicode_literals
+
+import time
+
+from contextlib import contextmanager
+from optparse import make_option
+
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, models, transaction, DEFAULT_DB_ALIAS
+
+from workflow.diff import changes_between_models, DIFF_ENGINES
+from workflow.formats import get_format, get_format_names, COMPRESSIONS
+from workflow.constants import VERSION_STATUS_APPROVED, VERSION_TYPE_CHANGE, VERSION_TYPE_DELETE
+from workflow.models import Revision
+from workflow.revisions import RevisionManager, RegistrationError
+
+
+@contextmanager
+def rolled_back(db):
+    """Runs a block of code in a transaction which is always rolled back."""
+    transaction.enter_transaction_management(using=db)
+    transaction.managed(True, using=db)
+    try:
+        yield
+    finally:
+        transaction.rollback(using=db)
+        transaction.leave_transaction_management(using=db)
+
+
+class Measurement(object):
+    """Measures wall time and number of queries of a block of code."""
+
+    def __init__(self, db):
+        self.connection = connections[db]
+        self.queries = 0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self._debug_cursor = self.connection.use_debug_cursor
+        self.connection.use_debug_cursor = True
+        self._queries_before = len(self.connection.queries)
+        self._started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.time() - self._started
+        self.queries = len(self.connection.queries) - self._queries_before
+        self.connection.use_debug_cursor = self._debug_cursor
+
+    def __unicode__(self):
+        return "{queries:>6} queries {elapsed:>9.4f}s".format(
+            queries=self.queries, elapsed=self.elapsed)
+
+    __str__ = __unicode__
+
+
+def wide_model(field_count):
+    """Returns an unmanaged model with the given number of text fields."""
+    attrs = dict(
+        ("field_{0}".format(i), models.CharField(max_length=255, blank=True))
+        for i in range(field_count))
+    attrs["__module__"] = __name__
+    attrs["Meta"] = type(str("Meta"), (), {"app_label": "workflow", "managed": False})
+    return type(str("WorkflowBenchmarkWide{0}".format(field_count)), (models.Model,), attrs)
+
+
+class Command(BaseCommand):
+    """
+    A management command which measures performance of workflow operations.
+
+    Every benchmark runs inside a transaction which is rolled back, so
+    it leaves no data behind.
+    """
+
+    help = "Benchmark workflow operations"
+    args = "[benchmark benchmark ...]"
+
+    benchmarks = ("revisions", "formats", "revert_delete", "diff", "text_diff")
+
+    option_list = BaseCommand.option_list + (
+        make_option("--database",
+            action="store",
+            dest="database",
+            default=DEFAULT_DB_ALIAS,
+            help="Nominates a database to run benchmarks against."),
+        make_option("--sizes",
+            action="store",
+            dest="sizes",
+            default="1,100,10000",
+            help="Comma separated numbers of objects to benchmark with."),
+    )
+
+    def handle(self, *names, **options):
+        names = names or self.benchmarks
+        for name in names:
+            if name not in self.benchmarks:
+                raise CommandError("Unknown benchmark {name!r}, choose from: {choices}".format(
+                    name=name, choices=", ".join(self.benchmarks)))
+        db = options["database"]
+        sizes = [int(size) for size in options["sizes"].split(",") if size]
+        for name in names:
+            self.stdout.write("{name}\n".format(name=name))
+            getattr(self, "benchmark_{name}".format(name=name))(sizes, db)
+
+    def report(self, size, **measurements):
+        self.stdout.write("  {size:>8} objects  {results}\n".format(
+            size=size,
+            results="  ".join(
+                "{label}: {measurement}".format(label=label, measurement=measurement)
+                for label, measurement in sorted(measurements.items()))))
+
+    def create_groups(self, size, db):
+        """Creates the given number of throwaway objects to version."""
+        Group.objects.using(db).bulk_create([
+            Group(name="workflow-benchmark-{0}".format(i)) for i in range(size)])
+        return list(Group.objects.using(db).filter(
+            name__startswith="workflow-benchmark-"))
+
+    @contextmanager
+    def revision_manager(self, *models, **field_overrides):
+        """Returns a throwaway revision manager with the given models registered."""
+        try:
+            manager = RevisionManager.get_manager("workflow-benchmark")
+        except RegistrationError:
+            manager = RevisionManager("workflow-benchmark")
+        for model in models:
+            manager.register(model, **field_overrides)
+        try:
+            yield manager
+        finally:
+            for model in models:
+                manager.unregister(model)
+
+    def benchmark_revisions(self, sizes, db):
+        """Saves revisions with versions inserted one by one and in bulk."""
+        with self.revision_manager(Group) as manager:
+            for size in sizes:
+                with rolled_back(db):
+                    groups = self.create_groups(size, db)
+                    measurements = {}
+                    for label, batch_size in (("single", 0), ("bulk", None)):
+                        with Measurement(db) as measurement:
+                            manager.save_revision(groups, batch_size=batch_size, db=db)
+                        measurements[label] = measurement
+                    self.report(size, **measurements)
+
+    def benchmark_formats(self, sizes, db):
+        """Serializes and deserializes objects in every registered format."""
+        format_names = get_format_names()
+        format_names += [
+            "{name}+{compression}".format(name=name, compression=compression)
+            for name in format_names for compression in sorted(COMPRESSIONS)]
+        for size in sizes:
+            with rolled_back(db):
+                groups = self.create_groups(size, db)
+                for format_name in format_names:
+                    version_format = get_format(format_name)
+                    with Measurement(db) as serialize:
+                        data = [version_format.serialize(group, None) for group in groups]
+                    with Measurement(db) as deserialize:
+                        for serialized_data in data:
+                            version_format.deserialize(serialized_data, db)
+                    self.stdout.write("  {0}\n".format(format_name))
+                    self.report(size,
+                        serialize = serialize,
+                        deserialize = deserialize,
+                        bytes = sum(len(serialized_data.encode("utf-8")) for serialized_data in data))
+
+    def benchmark_revert_delete(self, sizes, db):
+        """Deletes objects marked as deleted in a revision when it's reverted."""
+        with self.revision_manager(Group) as manager:
+            adapter = manager.get_adapter(Group)
+            for size in sizes:
+                with rolled_back(db):
+                    groups = self.create_groups(size, db)
+                    # Every other object is deleted in the revision.
+                    revision = manager.save_revision(dict(
+                        (group, adapter.get_version_data(
+                            group, VERSION_TYPE_DELETE if i % 2 else VERSION_TYPE_CHANGE, db))
+                        for i, group in enumerate(groups)),
+                        status = VERSION_STATUS_APPROVED,
+                        db = db)
+                    revision = Revision.objects.using(db).get(pk=revision.pk)
+                    with Measurement(db) as measurement:
+                        revision.delete_unrevisioned_objects()
+                    self.report(size, delete=measurement)
+
+    def benchmark_diff(self, sizes, db):
+        """Diffs pairs of objects of a model with 150 fields, two of them changed."""
+        model = wide_model(150)
+        values = dict(("field_{0}".format(i), "value {0}".format(i)) for i in range(150))
+        for size in sizes:
+            pairs = []
+            for i in range(size):
+                old_object = model(pk=i, **values)
+                new_object = model(pk=i, **values)
+                new_object.field_0 = "changed value {0}".format(i)
+                new_object.field_100 = "changed value {0}".format(i)
+                pairs.append((old_object, new_object))
+            with Measurement(db) as compare:
+                changes = [changes_between_models(*pair) for pair in pairs]
+            with Measurement(db) as render:
+                for object_changes in changes:
+                    for change in object_changes.values():
+                        change.diff
+            self.report(size, compare=compare, render=render)
+
+    def benchmark_text_diff(self, sizes, db):
+        """Diffs texts of the given number of lines, every tenth line changed, with every engine."""
+        for size in sizes:
+            old_text = "".join(
+                "Line {0} of the <b>old</b> text.\n".format(i) for i in range(size))
+            new_text = "".join(
+                "Line {0} of the <b>{1}</b> text.\n".format(i, "new" if i % 10 == 0 else "old")
+                for i in range(size))
+            measurements = {}
+            for name in sorted(DIFF_ENGINES):
+                with Measurement(db) as measurements[name]:
+                    DIFF_ENGINES[name](old_text, new_text)
+            self.report(size, **measurements)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Module contains compress_versions management command.
+"""
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.utils.encoding import force_bytes
+
+from workflow.formats import get_format, CompressedFormat
+from workflow.models import Version
+from workflow.settings import WORKFLOW_COMPRESSION, WORKFLOW_COMPRESSION_LEVEL
+
+
+class Command(BaseCommand):
+    """
+    A management command which rewrites serialized data of stored versions
+    with the given compression, e.g. after compression has been enabled.
+
+    Versions are processed in batches ordered by primary key, every batch
+    in its own transaction.
+    """
+
+    help = "Compress serialized data of stored versions"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--database",
+            action="store",
+            dest="database",
+            default=DEFAULT_DB_ALIAS,
+            help="Nominates a database to compress versions in."),
+        make_option("--batch-size",
+            action="store",
+            dest="batch_size",
+            type="int",
+            default=1000,
+            help="Number of versions updated per transaction."),
+        make_option("--compression",
+            action="store",
+            dest="compression",
+            default=WORKFLOW_COMPRESSION or "zlib",
+            help="Compression to store data with: zlib, lzma or none to decompress."),
+        make_option("--level",
+            action="store",
+            dest="level",
+            type="int",
+            default=WORKFLOW_COMPRESSION_LEVEL,
+            help="Compression level."),
+    )
+
+    def handle(self, *args, **options):
+        db = options["database"]
+        compression = options["compression"]
+        if compression == "none":
+            compression = None
+        count, size_before, size_after = self.compress(
+            db, options["batch_size"], compression, options["level"])
+        saved = size_before - size_after
+        self.stdout.write(
+            "Rewrote {count} versions: {before} bytes before, {after} bytes after, "
+            "{saved} bytes ({percent:.1f}%) saved.\n".format(
+                count=count, before=size_before, after=size_after, saved=saved,
+                percent=100.0 * saved / size_before if size_before else 0.0))
+
+    def get_storage_format(self, format_name, compression, level):
+        """Returns the format to store data of the given uncompressed format in."""
+        if compression is None:
+            return get_format(format_name)
+        return CompressedFormat(get_format(format_name), compression, level)
+
+    def compress(self, db, batch_size, compression, level):
+        versions = Version.objects.using(db).order_by("pk")
+        if compression is None:
+            versions = versions.filter(format__contains="+")
+        else:
+            versions = versions.exclude(format__endswith="+" + compression)
+        count = size_before = size_after = 0
+        storage_formats = {}
+        last_pk = 0
+        while True:
+            batch = list(versions.filter(pk__gt=last_pk).values_list(
+                "pk", "format", "serialized_data")[:batch_size])
+            if not batch:
+                return count, size_before, size_after
+            with transaction.commit_on_success(using=db):
+                for pk, format_name, serialized_data in batch:
+                    version_format = get_format(format_name)
+                    # Only the compression layer is replaced: deltas stay
+                    # deltas against the same base versions.
+                    if isinstance(version_format, CompressedFormat):
+                        base_format = version_format.base
+                    else:
+                        base_format = version_format
+                    if base_format.name not in storage_formats:
+                        storage_formats[base_format.name] = self.get_storage_format(
+                            base_format.name, compression, level)
+                    storage_format = storage_formats[base_format.name]
+                    data = storage_format.encode(version_format.decode(serialized_data))
+                    Version.objects.using(db).filter(pk=pk).update(
+                        format=storage_format.name,
+                        serialized_data=data)
+                    size_before += len(force_bytes(serialized_data))
+                    size_after += len(force_bytes(data))
+            count += len(batch)
+            last_pk = batch[-1][0]
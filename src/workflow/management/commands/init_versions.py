@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Module contains init_versions management command.
+"""
+from __future__ import unicode_literals
+
+import datetime
+
+from optparse import make_option
+
+from django.contrib import admin
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.db.models import get_model, Max, Min
+from django.utils.encoding import force_text
+
+from workflow.constants import VERSION_STATUS_APPROVED, VERSION_TYPE_ADD
+from workflow.models import (
+    Revision, Version, LatestApprovedVersion,
+    has_int_pk, chunked_objects_filters, get_digest, get_revision_digest)
+from workflow.revisions import RevisionManager
+
+
+class Command(BaseCommand):
+    """
+    A management command which creates an initial approved version of every
+    object of registered models that has no approved version yet.
+
+    Objects are read in chunks ordered by primary key. Every chunk is saved
+    in its own transaction, objects which already have an approved version
+    are skipped, so an interrupted run can be simply restarted. Workers can
+    process separate primary key ranges in parallel with --workers and
+    --worker options.
+    """
+
+    help = "Create initial versions of objects which have none"
+    args = "[app_label.ModelName ...]"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--manager",
+            action="store",
+            dest="manager",
+            default="default",
+            help="Slug of the revision manager models are registered with."),
+        make_option("--database",
+            action="store",
+            dest="database",
+            default=DEFAULT_DB_ALIAS,
+            help="Nominates a database to create versions in."),
+        make_option("--chunk-size",
+            action="store",
+            dest="chunk_size",
+            type="int",
+            default=500,
+            help="Number of objects saved per transaction."),
+        make_option("--comment",
+            action="store",
+            dest="comment",
+            default="Initial version.",
+            help="Comment of created revisions."),
+        make_option("--min-pk",
+            action="store",
+            dest="min_pk",
+            default=None,
+            help="Smallest primary key of objects to process."),
+        make_option("--max-pk",
+            action="store",
+            dest="max_pk",
+            default=None,
+            help="Largest primary key of objects to process."),
+        make_option("--workers",
+            action="store",
+            dest="workers",
+            type="int",
+            default=1,
+            help="Number of workers integer primary key range is split between."),
+        make_option("--worker",
+            action="store",
+            dest="worker",
+            type="int",
+            default=0,
+            help="Zero-based number of the worker whose range is processed."),
+    )
+
+    def handle(self, *labels, **options):
+        if not 0 <= options["worker"] < options["workers"]:
+            raise CommandError("--worker must be between 0 and --workers - 1")
+        # Models are registered with revision managers by admin classes.
+        admin.autodiscover()
+        manager = RevisionManager.get_manager(options["manager"])
+        if labels:
+            models = [self.get_model(label) for label in labels]
+            for model in models:
+                if not manager.is_registered(model):
+                    raise CommandError("{model} is not registered with {manager!r} manager".format(
+                        model=model.__name__, manager=options["manager"]))
+        else:
+            models = manager.get_registered_models()
+        for model in models:
+            count = self.snapshot_model(manager, model, options)
+            self.stdout.write("{model}: created {count} versions.\n".format(
+                model=model.__name__, count=count))
+
+    def get_model(self, label):
+        try:
+            app_label, model_name = label.split(".")
+        except ValueError:
+            raise CommandError("Model must be given as app_label.ModelName, got {0!r}".format(label))
+        model = get_model(app_label, model_name)
+        if model is None:
+            raise CommandError("Unknown model {0!r}".format(label))
+        return model
+
+    def get_queryset(self, model, options):
+        """Returns objects of the model which this worker has to process."""
+        db = options["database"]
+        queryset = model._default_manager.using(db).order_by("pk")
+        min_pk, max_pk = options["min_pk"], options["max_pk"]
+        if options["workers"] > 1:
+            if not has_int_pk(model):
+                raise CommandError("{0} has no integer primary key and cannot be split between workers".format(
+                    model.__name__))
+            bounds = queryset.aggregate(min_pk=Min("pk"), max_pk=Max("pk"))
+            lowest = int(min_pk) if min_pk is not None else bounds["min_pk"]
+            highest = int(max_pk) if max_pk is not None else bounds["max_pk"]
+            if lowest is None or highest is None:
+                return queryset.none()
+            step = (highest - lowest) // options["workers"] + 1
+            min_pk = lowest + step * options["worker"]
+            max_pk = min(highest, min_pk + step - 1)
+        if min_pk is not None:
+            queryset = queryset.filter(pk__gte=min_pk)
+        if max_pk is not None:
+            queryset = queryset.filter(pk__lte=max_pk)
+        return queryset
+
+    def snapshot_model(self, manager, model, options):
+        queryset = self.get_queryset(model, options)
+        count = 0
+        last_pk = None
+        while True:
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            objs = list(chunk[:options["chunk_size"]])
+            if not objs:
+                return count
+            last_pk = objs[-1].pk
+            count += self.snapshot_chunk(manager, model, objs, options)
+
+    def get_versioned_ids(self, model, objs, db):
+        """
+        Returns ids of the given objects which have an approved version.
+        Versions are looked up by the indexed integer key or hash of the key,
+        see object_lookup().
+        """
+        content_type = ContentType.objects.db_manager(db).get_for_model(model)
+        if has_int_pk(model):
+            lookup = {"object_id_int__in": [obj.pk for obj in objs]}
+        else:
+            lookup = {"object_id_hash__in": [get_digest(force_text(obj.pk)) for obj in objs]}
+        return set(Version.objects.using(db).filter(
+            content_type=content_type,
+            revision__status=VERSION_STATUS_APPROVED,
+            **lookup
+        ).values_list("object_id", flat=True))
+
+    def snapshot_chunk(self, manager, model, objs, options):
+        db = options["database"]
+        versioned_ids = self.get_versioned_ids(model, objs, db)
+        objs = [obj for obj in objs if force_text(obj.pk) not in versioned_ids]
+        if not objs:
+            return 0
+        # Serialize objects and the objects they follow before any locks
+        # are taken, so workers do the expensive part in parallel.
+        # Relationships of the whole chunk are followed together.
+        if manager.get_adapter(model).follow:
+            followed = manager._follow_relationships_of_each(objs)
+        else:
+            followed = dict((obj, [obj]) for obj in objs)
+        revision_data = []
+        for obj in objs:
+            revision_data.append([
+                manager.get_adapter(revision_object.__class__).get_version_data(
+                    revision_object, VERSION_TYPE_ADD, db)
+                for revision_object in followed[obj]])
+        with transaction.commit_on_success(using=db):
+            self.save_revisions(manager, revision_data, options)
+        return len(objs)
+
+    def save_revisions(self, manager, revision_data, options):
+        """Saves an approved root revision for each list of version data."""
+        db = options["database"]
+        # Revisions are inserted in bulk as roots of new trees. Workers are
+        # serialized on a lock of revision's content type row, so they
+        # don't assign the same tree ids.
+        list(ContentType.objects.db_manager(db).select_for_update().filter(
+            pk=ContentType.objects.db_manager(db).get_for_model(Revision).pk,
+        ).values_list("pk"))
+        next_tree_id = (Revision.objects.using(db).aggregate(
+            Max("tree_id"))["tree_id__max"] or 0) + 1
+        now = datetime.datetime.now()
+        revisions = [
+            Revision(
+                manager_slug=options["manager"],
+                comment=options["comment"],
+                status=VERSION_STATUS_APPROVED,
+                date_moderated=now,
+                digest=get_revision_digest(data["digest"] for data in version_data),
+                tree_id=next_tree_id + i,
+                lft=1,
+                rght=2,
+                level=0)
+            for i, version_data in enumerate(revision_data)]
+        Revision.objects.using(db).bulk_create(revisions)
+        ids = dict(Revision.objects.using(db).filter(
+            tree_id__gte=next_tree_id,
+            tree_id__lt=next_tree_id + len(revisions),
+        ).values_list("tree_id", "pk"))
+        versions = []
+        for revision, version_data in zip(revisions, revision_data):
+            revision.id = ids[revision.tree_id]
+            versions.extend(Version(revision=revision, **data) for data in version_data)
+        manager._save_versions(versions, db=db)
+        # All objects point to the new versions, moderated just now.
+        pointers = {}
+        for version in versions:
+            pointers[(version.content_type_id, version.object_id)] = LatestApprovedVersion(
+                content_type_id=version.content_type_id,
+                object_id=version.object_id,
+                object_id_int=version.object_id_int,
+                object_id_hash=version.object_id_hash,
+                version=version,
+                revision=version.revision,
+                date_moderated=now)
+        pointers = list(pointers.values())
+        for lookup in chunked_objects_filters(pointers):
+            LatestApprovedVersion.objects.using(db).filter(lookup).delete()
+        LatestApprovedVersion.objects.using(db).bulk_create(pointers)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Module contains process_deferred_revisions management command.
+"""
+from __future__ import unicode_literals
+
+import time
+
+from optparse import make_option
+
+from django.contrib import admin
+from django.core.management.base import BaseCommand
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.utils.encoding import force_text
+
+from workflow.models import DeferredRevision
+from workflow.revisions import RevisionManager
+
+
+class Command(BaseCommand):
+    """
+    A management command which saves revisions queued while
+    WORKFLOW_DEFERRED_CAPTURE setting is enabled.
+
+    Queued revisions are saved in the order they were queued. Batches are
+    locked while they are processed, so concurrently running commands
+    don't save the same revision twice or reorder revisions of an object.
+    Revisions which fail are kept in the queue with the error. Later
+    revisions of their objects are kept in the queue as well until the
+    failed ones are retried with --retry-failed or dropped with
+    --delete-failed, so revisions of an object are never saved out of order.
+    """
+
+    help = "Save queued deferred revisions"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--database",
+            action="store",
+            dest="database",
+            default=DEFAULT_DB_ALIAS,
+            help="Nominates a database to process the queue of."),
+        make_option("--batch-size",
+            action="store",
+            dest="batch_size",
+            type="int",
+            default=100,
+            help="Number of revisions saved per transaction."),
+        make_option("--interval",
+            action="store",
+            dest="interval",
+            type="float",
+            default=0,
+            help="Seconds to wait before polling an empty queue again, zero exits instead."),
+        make_option("--retry-failed",
+            action="store_true",
+            dest="retry_failed",
+            default=False,
+            help="Clears errors of failed revisions, so they are saved again."),
+        make_option("--delete-failed",
+            action="store_true",
+            dest="delete_failed",
+            default=False,
+            help="Deletes failed revisions from the queue, releasing later revisions of their objects."),
+    )
+
+    def handle(self, *args, **options):
+        db = options["database"]
+        # Models are registered with revision managers by admin classes.
+        admin.autodiscover()
+        failed = DeferredRevision.objects.using(db).exclude(error="")
+        if options["retry_failed"]:
+            self.stdout.write("Retrying {count} failed deferred revisions.\n".format(
+                count=failed.update(error="")))
+        elif options["delete_failed"]:
+            self.stdout.write("Deleting {count} failed deferred revisions.\n".format(
+                count=failed.count()))
+            failed.delete()
+        count = 0
+        while True:
+            processed = self.process_queue(db, options["batch_size"])
+            count += processed
+            if processed:
+                continue
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write("Processed {count} deferred revisions.\n".format(count=count))
+
+    def get_failed_objects(self, db):
+        """Returns a set of (content_type_id, object_id) of objects of failed revisions."""
+        objects = set()
+        for deferred_revision in DeferredRevision.objects.using(db).exclude(error=""):
+            objects.update(deferred_revision.get_object_keys())
+        return objects
+
+    def process_queue(self, db, batch_size):
+        """
+        Saves queued revisions batch by batch, skipping revisions of objects
+        of failed revisions. Returns the number of saved revisions.
+        """
+        blocked = self.get_failed_objects(db)
+        count = 0
+        last_pk = 0
+        while True:
+            processed, last_pk = self.process_batch(db, batch_size, last_pk, blocked)
+            if last_pk is None:
+                return count
+            count += processed
+
+    def process_batch(self, db, batch_size, last_pk, blocked):
+        """
+        Saves a batch of queued revisions after `last_pk`. Revisions of
+        objects in the `blocked` set are skipped, objects of revisions which
+        fail or are skipped are added to it. Returns the number of saved
+        revisions and the primary key of the last revision of the batch,
+        or None if there was none.
+        """
+        with transaction.commit_on_success(using=db):
+            deferred_revisions = list(DeferredRevision.objects.using(db).select_for_update().filter(
+                error="", pk__gt=last_pk).order_by("pk")[:batch_size])
+            if not deferred_revisions:
+                return 0, None
+            count = 0
+            for deferred_revision in deferred_revisions:
+                object_keys = deferred_revision.get_object_keys()
+                if not blocked.isdisjoint(object_keys):
+                    # An earlier revision of some of the objects failed.
+                    blocked.update(object_keys)
+                    continue
+                sid = transaction.savepoint(using=db)
+                try:
+                    manager = RevisionManager.get_manager(deferred_revision.manager_slug)
+                    manager.save_deferred_revision(deferred_revision, db)
+                except Exception as e:
+                    transaction.savepoint_rollback(sid, using=db)
+                    deferred_revision.error = force_text(e) or e.__class__.__name__
+                    deferred_revision.save(using=db)
+                    blocked.update(object_keys)
+                    self.stderr.write("Deferred revision {pk} failed: {error}\n".format(
+                        pk=deferred_revision.pk, error=deferred_revision.error))
+                else:
+                    transaction.savepoint_commit(sid, using=db)
+                    deferred_revision.delete()
+                    count += 1
+        return count, deferred_revisions[-1].pk
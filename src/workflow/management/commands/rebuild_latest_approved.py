@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Module contains rebuild_latest_approved management command.
+"""
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from workflow.constants import VERSION_STATUS_APPROVED
+from workflow.models import Version, LatestApprovedVersion
+
+
+class Command(BaseCommand):
+    """
+    A management command which rebuilds the table of latest approved
+    versions from scratch.
+    """
+
+    help = "Rebuild latest approved version pointers"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--database",
+            action="store",
+            dest="database",
+            default=DEFAULT_DB_ALIAS,
+            help="Nominates a database to rebuild pointers in."),
+        make_option("--batch-size",
+            action="store",
+            dest="batch_size",
+            type="int",
+            default=1000,
+            help="Number of pointers inserted per query."),
+    )
+
+    def handle(self, *args, **options):
+        db = options["database"]
+        batch_size = options["batch_size"]
+        with transaction.commit_on_success(using=db):
+            self.clear(db)
+            count = self.rebuild(db, batch_size)
+        self.stdout.write("Rebuilt {count} pointers.\n".format(count=count))
+
+    def clear(self, db):
+        connection = connections[db]
+        connection.cursor().execute("DELETE FROM {table}".format(
+            table=connection.ops.quote_name(LatestApprovedVersion._meta.db_table)))
+
+    def rebuild(self, db, batch_size):
+        # Versions are ordered the same way as VersionManager.latest_approved
+        # orders them, so the first version of each object is the current one.
+        versions = Version.objects.using(db).filter(
+            revision__status=VERSION_STATUS_APPROVED,
+        ).order_by(
+            'content_type', 'object_id', '-revision__date_moderated',
+        ).values_list(
+            'id', 'revision', 'content_type', 'object_id', 'object_id_int',
+            'object_id_hash', 'revision__date_moderated',
+        ).iterator()
+
+        count = 0
+        batch = []
+        last_key = None
+        for (version_id, revision_id, content_type_id, object_id, object_id_int,
+             object_id_hash, date_moderated) in versions:
+            key = (content_type_id, object_id)
+            if key == last_key:
+                continue
+            last_key = key
+            batch.append(LatestApprovedVersion(
+                content_type_id=content_type_id,
+                object_id=object_id,
+                object_id_int=object_id_int,
+                object_id_hash=object_id_hash,
+                version_id=version_id,
+                revision_id=revision_id,
+                date_moderated=date_moderated))
+            if len(batch) >= batch_size:
+                LatestApprovedVersion.objects.using(db).bulk_create(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            LatestApprovedVersion.objects.using(db).bulk_create(batch)
+            count += len(batch)
+        return count
@@ -2,8 +2,14 @@
 """Database models used by workflow."""
 from __future__ import unicode_literals
 
+import copy
 import datetime
+import hashlib
+import json
 import logging
+import operator
+
+from functools import reduce
 
 from mptt.models import MPTTModel
 
@@ -12,12 +18,15 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.conf import settings
-from django.core import serializers
-from django.db import models
-from django.db.models import F
-from django.utils.encoding import force_text
+from django.db import models, transaction, DatabaseError, DEFAULT_DB_ALIAS
+from django.db.models import F, Q
+from django.db.models.signals import pre_save, post_save, post_init
+from django.utils.encoding import force_text, force_bytes
 from django.utils.translation import ugettext_lazy as _
 
+from workflow.cache import version_cache
+from workflow.formats import get_format, get_storage_format, deserialize_record, dump_record
+from workflow.settings import WORKFLOW_BULK_BATCH_SIZE
 from workflow.constants import (
     VERSION_STATUSES, VERSION_STATUS_DRAFT, VERSION_STATUS_APPROVED,
     VERSION_TYPES, VERSION_TYPE_ADD, VERSION_TYPE_DELETE,
@@ -39,23 +48,205 @@ def has_int_pk(model):
     )
 
 
-def safe_revert(versions):
+def get_digest(data):
+    """Returns a hex digest of the given text."""
+    return hashlib.sha1(force_bytes(data)).hexdigest()
+
+
+def get_revision_digest(digests):
+    """Combines digests of revision's versions into a digest of the revision."""
+    return get_digest("\n".join(sorted(digests)))
+
+
+def object_lookup(content_type, object_id):
+    """
+    Returns lookup arguments which select versions of the given object.
+
+    Objects with an integer primary key are looked up by the indexed integer
+    key, others by the indexed hash of the key.
+    """
+    model = content_type.model_class()
+    if model is not None and has_int_pk(model):
+        try:
+            return {'content_type': content_type, 'object_id_int': int(object_id)}
+        except (TypeError, ValueError):
+            pass
+    object_id = force_text(object_id)
+    return {
+        'content_type': content_type,
+        'object_id_hash': get_digest(object_id),
+        'object_id': object_id,
+    }
+
+
+def chunked(iterable, size):
+    """Yields lists of at most `size` items of the iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Maximal number of values of an `__in` lookup, SQLite allows at most
+# 999 parameters per query.
+MAX_LOOKUP_SIZE = 900
+
+
+def lookup_chunks(values, size=None):
+    """
+    Yields lists of values of an `__in` lookup of at most `size` items,
+    WORKFLOW_BULK_BATCH_SIZE by default, and never more than MAX_LOOKUP_SIZE.
+    """
+    size = min(size or WORKFLOW_BULK_BATCH_SIZE or MAX_LOOKUP_SIZE, MAX_LOOKUP_SIZE)
+    return chunked(values, size)
+
+
+def version_key(version):
+    """Returns the indexed field name and value which identify version's object."""
+    if version.object_id_int is not None:
+        return 'object_id_int', version.object_id_int
+    return 'object_id_hash', version.object_id_hash
+
+
+def objects_filter(versions):
+    """Returns a filter selecting versions of the same objects as the given ones."""
+    lookups = {}
+    for version in versions:
+        field, value = version_key(version)
+        lookups.setdefault((version.content_type_id, field), []).append(value)
+    return reduce(operator.or_, (
+        Q(**{'content_type': content_type_id, '%s__in' % field: values})
+        for (content_type_id, field), values in lookups.items()
+    ))
+
+
+def chunked_objects_filters(versions, size=None):
+    """
+    Yields filters selecting versions of the same objects as the given
+    ones like objects_filter(), each with at most `size` lookup values,
+    see lookup_chunks().
     """
-    Attempts to revert the given models contained in the give versions.
+    lookups = {}
+    for version in versions:
+        field, value = version_key(version)
+        lookups.setdefault((version.content_type_id, field), []).append(value)
+    for (content_type_id, field), values in lookups.items():
+        for chunk in lookup_chunks(values, size):
+            yield Q(**{'content_type': content_type_id, '%s__in' % field: chunk})
+
+
+class RevertError(Exception):
+    """Exception raised when objects of a revision can't be reverted."""
 
-    This method will attempt to resolve dependencies between the versions to revert
-    them in the correct order to avoid database integrity errors.
+    def __init__(self, message, errors=()):
+        super(RevertError, self).__init__(message)
+        # A list of (model, object ids, exception) tuples.
+        self.errors = list(errors)
+
+
+def dependency_order(models):
+    """
+    Returns the given models ordered so that models referenced by foreign
+    keys, including parents of inherited models, precede models which
+    reference them. Models in reference cycles keep their original order.
+    """
+    models = list(models)
+    dependencies = dict(
+        (model, set(
+            field.rel.to for field in model._meta.fields
+            if field.rel and field.rel.to in models and field.rel.to is not model))
+        for model in models)
+    ordered = []
+    while dependencies:
+        ready = [model for model in models if model in dependencies and not dependencies[model]]
+        if not ready:
+            # Break a cycle, the database has to cope with it.
+            ready = [model for model in models if model in dependencies][:1]
+        for model in ready:
+            ordered.append(model)
+            del dependencies[model]
+        for model_dependencies in dependencies.values():
+            model_dependencies.difference_update(ready)
+    return ordered
+
+
+def _write_objects(model, objs, db):
     """
-    unreverted_versions = []
+    Writes the given deserialized objects of the model: missing rows are
+    inserted in bulk, existing rows are updated without a lookup. Rows are
+    inserted one by one if the model has pre_save or post_save receivers,
+    since bulk inserts don't send them.
+    """
+    manager = model._base_manager.using(db)
+    existing = set()
+    for pks in lookup_chunks([obj.pk for obj in objs]):
+        existing.update(manager.filter(pk__in=pks).values_list('pk', flat=True))
+    new_objs = [obj for obj in objs if obj.pk not in existing]
+    if new_objs:
+        # Inherited models can't be inserted in bulk.
+        can_bulk_create = (
+            not model._meta.parents and
+            not pre_save.has_listeners(model) and
+            not post_save.has_listeners(model))
+        if can_bulk_create:
+            manager.bulk_create(new_objs)
+        else:
+            for obj in new_objs:
+                obj.save_base(using=db, raw=True, force_insert=True)
+    for obj in objs:
+        if obj.pk in existing:
+            obj.save_base(using=db, raw=True, force_update=True)
+
+
+def safe_revert(versions, db=None):
+    """
+    Reverts the models contained in the given versions.
+
+    Every version is deserialized once. Objects are written model by model
+    in order of foreign key dependencies between models, each model in its
+    own savepoint. Many-to-many relations are restored once all objects are
+    written. RevertError listing models which couldn't be written is raised
+    on failure.
+    """
+    versions = list(versions)
+    if not versions:
+        return
+    db = db or versions[0]._state.db or DEFAULT_DB_ALIAS
+    object_versions = {}
+    models_order = []
     for version in versions:
+        object_version = version.object_version
+        model = object_version.object.__class__
+        if model not in object_versions:
+            object_versions[model] = []
+            models_order.append(model)
+        object_versions[model].append(object_version)
+    errors = []
+    for model in dependency_order(models_order):
+        objs = [object_version.object for object_version in object_versions[model]]
+        sid = transaction.savepoint(using=db)
         try:
-            version.revert()
-        except (IntegrityError, ObjectDoesNotExist):
-            unreverted_versions.append(version)
-    if len(unreverted_versions) == len(versions):
-        raise RevertError("Could not revert revision, due to database integrity errors.")
-    if unreverted_versions:
-        safe_revert(unreverted_versions)
+            _write_objects(model, objs, db)
+        except DatabaseError as e:
+            transaction.savepoint_rollback(sid, using=db)
+            errors.append((model, [force_text(obj.pk) for obj in objs], e))
+        else:
+            transaction.savepoint_commit(sid, using=db)
+    if errors:
+        raise RevertError(
+            "Could not revert revision, due to database integrity errors: {0}".format("; ".join(
+                "{model} {ids}: {error}".format(
+                    model=model.__name__, ids=", ".join(ids), error=force_text(error))
+                for model, ids, error in errors)),
+            errors)
+    for model_versions in object_versions.values():
+        for object_version in model_versions:
+            for accessor_name, object_list in object_version.m2m_data.items():
+                setattr(object_version.object, accessor_name, object_list)
 
 
 class Revision(MPTTModel):
@@ -98,41 +289,134 @@ class Revision(MPTTModel):
         max_length = 200,
         db_index = True,
         default = "default")
+    digest = models.CharField(
+        max_length = 40,
+        blank = True,
+        db_index = True,
+        help_text = "A digest combined from digests of revision's versions.")
 
     def version(self, id, content_type):
-        return self.version_set.get(object_id=id, content_type=content_type)
+        if hasattr(self, "_version_index_cache"):
+            try:
+                return self._version_index_cache[(content_type.id, force_text(id))]
+            except KeyError:
+                raise Version.DoesNotExist("Revision has no version of the object.")
+        return self.version_set.get(**object_lookup(content_type, id))
+
+    def get_version_index(self):
+        """
+        Returns all versions of this revision fetched with a single query,
+        indexed by (content_type_id, object_id).
+        """
+        if not hasattr(self, "_version_index_cache"):
+            index = {}
+            for version in self.version_set.all():
+                version.revision = self
+                index[(version.content_type_id, version.object_id)] = version
+            self._version_index_cache = index
+        return self._version_index_cache
+
+    def get_related_version_index(self, model, field_name):
+        """
+        Returns versions of the given model in this revision indexed by the
+        value of the given field: {field value: {object_id: version}}.
+
+        The index is built once per revision instance. Only versions of the
+        given model are fetched and deserialized.
+        """
+        cache = self.__dict__.setdefault("_related_version_index_cache", {})
+        key = (model, field_name)
+        if key not in cache:
+            content_type = ContentType.objects.get_for_model(model)
+            if hasattr(self, "_version_index_cache"):
+                versions = [
+                    version for version in self._version_index_cache.values()
+                    if version.content_type_id == content_type.id]
+            else:
+                versions = self.version_set.filter(content_type=content_type)
+            index = {}
+            for version in versions:
+                version.revision = self
+                value = force_text(version.field_dict.get(field_name))
+                index.setdefault(value, {})[version.object_id] = version
+            cache[key] = index
+        return cache[key]
 
     def revert(self, previous=None, delete=False):
         """Reverts all objects in this revision."""
-        version_set = self.version_set.all()
+        # Versions are fetched once and reused below.
+        version_set = list(self.get_version_index().values())
 
         if previous:
-            for v in previous.version_set.exclude(object_id__in=self.version_set.values_list('object_id')):
-                v.object_version.object.delete()
+            self.delete_stale_objects(previous, version_set)
 
         # Optionally delete objects no longer in the current revision.
         if delete:
-            # Get a dict of all objects in this revision.
-            old_revision = {}
-            for version in version_set:
-                try:
-                    obj = version.object
-                except ContentType.objects.get_for_id(version.content_type_id).model_class().DoesNotExist:
-                    pass
-                else:
-                    old_revision[obj] = version
-            # Calculate the set of all objects that are in the revision now.
-            from reversion.revisions import RevisionManager
-            current_revision = RevisionManager.get_manager(self.manager_slug)._follow_relationships(obj for obj in old_revision.keys() if obj is not None)
-            # Delete objects that are no longer in the current revision.
-            for item in current_revision:
-                if item in old_revision:
-                    if old_revision[item].object_type == VERSION_TYPE_DELETE:
-                        item.delete()
-                else:
-                    item.delete()
+            self.delete_unrevisioned_objects(version_set)
         # Attempt to revert all revisions.
-        safe_revert([version for version in version_set if version.object_type != VERSION_TYPE_DELETE])
+        safe_revert(
+            [version for version in version_set if version.object_type != VERSION_TYPE_DELETE],
+            self._state.db)
+
+    def delete_stale_objects(self, previous, version_set=None):
+        """
+        Deletes objects which have a version in the previous revision but
+        none in this one. Objects of the previous revision are fetched with
+        a single query and stale ones are deleted model by model in chunks.
+        """
+        if version_set is None:
+            version_set = list(self.get_version_index().values())
+        current = set((version.content_type_id, version.object_id) for version in version_set)
+        stale_ids = {}
+        for key in previous.version_set.values_list('content_type', 'object_id'):
+            if key not in current:
+                stale_ids.setdefault(key[0], set()).add(key[1])
+        db = self._state.db or DEFAULT_DB_ALIAS
+        for content_type_id, object_ids in stale_ids.items():
+            model = ContentType.objects.db_manager(db).get_for_id(content_type_id).model_class()
+            if model is None:
+                continue
+            for pks in lookup_chunks(list(object_ids)):
+                model._base_manager.using(db).filter(pk__in=pks).delete()
+
+    def delete_unrevisioned_objects(self, version_set=None):
+        """
+        Deletes objects which are currently related to the objects of this
+        revision but have no version in it, or have a version of deletion.
+
+        Live objects are fetched model by model in chunks and their related
+        objects are followed breadth-first by the revision manager of this
+        revision, then objects to delete are removed model by model in
+        chunks.
+        """
+        from workflow.revisions import RevisionManager
+        if version_set is None:
+            version_set = list(self.get_version_index().values())
+        db = self._state.db or DEFAULT_DB_ALIAS
+        content_types = ContentType.objects.db_manager(db)
+        # Get all live objects of this revision.
+        versions = {}
+        object_ids = {}
+        for version in version_set:
+            versions[(version.content_type_id, version.object_id)] = version
+            object_ids.setdefault(version.content_type_id, []).append(version.object_id)
+        live_objects = []
+        for content_type_id, ids in object_ids.items():
+            model = content_types.get_for_id(content_type_id).model_class()
+            if model is not None:
+                for pks in lookup_chunks(ids):
+                    live_objects.extend(model._base_manager.using(db).filter(pk__in=pks))
+        # Calculate the set of all objects that are in the revision now.
+        current_objects = RevisionManager.get_manager(self.manager_slug)._follow_relationships(live_objects)
+        # Delete objects that are no longer in the revision.
+        stale_ids = {}
+        for obj in current_objects:
+            version = versions.get((content_types.get_for_model(obj).id, force_text(obj.pk)))
+            if version is None or version.object_type == VERSION_TYPE_DELETE:
+                stale_ids.setdefault(obj.__class__, set()).add(obj.pk)
+        for model, ids in stale_ids.items():
+            for pks in lookup_chunks(list(ids)):
+                model._base_manager.using(db).filter(pk__in=pks).delete()
 
     def update_moderation(self, moderator):
         self.date_moderated = datetime.datetime.now()
@@ -153,15 +437,39 @@ class VersionManager(models.Manager):
     Custom manager for Version model.
     """
     def latest_approved(self, content_type, object_id):
+        """
+        Returns the latest approved version of the given object.
+
+        The version is taken from the LatestApprovedVersion pointer table.
+        If there is no pointer yet, versions are scanned and the pointer is
+        stored for subsequent lookups. That is the only write done by the
+        lookup: existing pointers are maintained on revision saves only.
+        """
+        pointer = LatestApprovedVersion.objects.db_manager(self.db).lookup(
+            content_type, object_id)
+        if pointer is not None:
+            return pointer.version
+        version = self.scan_latest_approved(content_type, object_id)
+        if version is not None:
+            LatestApprovedVersion.objects.db_manager(self.db).point_to(version)
+        return version
+
+    def scan_latest_approved(self, content_type, object_id):
+        """
+        Finds the latest approved version of the given object by scanning
+        all its versions.
+        """
         try:
-            return Version.objects.filter(
-                object_id=object_id,
-                content_type=content_type,
+            return self.for_object(content_type, object_id).filter(
                 revision__status=VERSION_STATUS_APPROVED
-            ).latest('revision__date_moderated')
+            ).select_related('revision').latest('revision__date_moderated')
         except Version.DoesNotExist:
             return None
 
+    def for_object(self, content_type, object_id):
+        """Returns all versions of the given object."""
+        return self.filter(**object_lookup(content_type, object_id))
+
     def children_info(self, content_type, object_id, version=None):
         """
         Returns tuple: (has_children, can_be_branched)
@@ -178,6 +486,15 @@ class VersionManager(models.Manager):
             revision__lft=F('revision__rght')-1)
 
 
+def _materialize_deltas(collector, field, sub_objs, using):
+    """
+    Stores delta versions of a deleted base version as full versions
+    instead of deleting them in cascade.
+    """
+    for version in sub_objs:
+        version.materialize()
+
+
 class Version(models.Model):
     """A saved version of a database model."""
 
@@ -192,6 +509,10 @@ class Version(models.Model):
         null = True,
         db_index = True,
         help_text = "An indexed, integer version of the stored model's primary key, used for faster lookups.",)
+    object_id_hash = models.CharField(
+        max_length = 40,
+        blank = True,
+        help_text = "A hash of the stored model's non-integer primary key, used for faster lookups.",)
     content_type = models.ForeignKey(ContentType,
         related_name="workflow_version_ct")
 
@@ -203,6 +524,20 @@ class Version(models.Model):
         help_text="The serialization format used by this model.")
     serialized_data = models.TextField(
         help_text="The serialized form of this version of the model.")
+    digest = models.CharField(
+        max_length = 40,
+        blank = True,
+        db_index = True,
+        help_text = "A digest of the serialized data, used for faster comparison.")
+    base_version = models.ForeignKey('self',
+        blank = True,
+        null = True,
+        related_name = '+',
+        on_delete = _materialize_deltas,
+        help_text = "The version the serialized data of a delta version applies to.")
+    delta_depth = models.PositiveIntegerField(
+        default = 0,
+        help_text = "Number of delta versions up to the nearest full version.")
     object_repr = models.TextField(
         help_text="A string representation of the object.")
     object_type = models.CharField(
@@ -213,10 +548,110 @@ class Version(models.Model):
 
     @property
     def object_version(self):
-        """The stored version of the model."""
-        data = self.serialized_data
-        data = force_text(data.encode("utf8"))
-        return list(serializers.deserialize(self.format, data, ignorenonexistent=True))[0]
+        """
+        The stored version of the model.
+
+        Deserialized object is memoized per instance. If process-level
+        version cache is enabled, it is also cached by version's primary key
+        and digest, and copies are returned from there.
+        """
+        if not hasattr(self, "_object_version_cache"):
+            self._object_version_cache = self._load_object_version()
+        return self._object_version_cache
+
+    def _load_object_version(self):
+        """Deserializes the stored version, using process-level cache if enabled."""
+        cache_key = (self.pk, self.digest)
+        use_cache = version_cache is not None and self.pk is not None
+        if use_cache:
+            object_version = version_cache.get(cache_key)
+            if object_version is not None:
+                return copy.deepcopy(object_version)
+        db = self._state.db or DEFAULT_DB_ALIAS
+        version_format = get_format(self.format)
+        if version_format.is_delta:
+            object_version = deserialize_record(self.get_record(), db)
+        else:
+            object_version = version_format.deserialize(self.serialized_data, db)
+        if use_cache:
+            version_cache.set(cache_key, copy.deepcopy(object_version))
+        return object_version
+
+    def get_record(self):
+        """
+        Returns the stored version as a record of Django "python"
+        serialization format.
+
+        Delta versions are reconstructed from records of their base
+        versions. Records are memoized per instance and, if process-level
+        version cache is enabled, cached by primary key and digest, so
+        intermediate states of delta chains are reused. Returned record
+        is shared and must not be modified.
+        """
+        if not hasattr(self, "_record_cache"):
+            cache_key = ("record", self.pk, self.digest)
+            use_cache = version_cache is not None and self.pk is not None
+            record = version_cache.get(cache_key) if use_cache else None
+            if record is None:
+                version_format = get_format(self.format)
+                if version_format.is_delta:
+                    record = version_format.apply(
+                        self.base_version.get_record(), self.serialized_data)
+                else:
+                    record = version_format.to_record(
+                        self.serialized_data, self._state.db or DEFAULT_DB_ALIAS)
+                if use_cache:
+                    version_cache.set(cache_key, record)
+            self._record_cache = record
+        return self._record_cache
+
+    def encode_delta(self, base_version, db=None):
+        """
+        Stores this unsaved version as a delta against the given version of
+        the same object, if it's stored in a format supporting records and
+        the base version is stored either so or as a delta itself.
+        Returns whether the version has been encoded.
+        """
+        version_format = get_format(self.format)
+        if version_format.is_delta or not version_format.supports_records:
+            return False
+        base_format = get_format(base_version.format)
+        if not base_format.supports_records and not base_format.is_delta:
+            return False
+        db = db or DEFAULT_DB_ALIAS
+        storage_format = get_storage_format("delta")
+        data = storage_format.diff(
+            base_version.get_record(), version_format.to_record(self.serialized_data, db))
+        if data is None:
+            return False
+        data = storage_format.encode(data)
+        if len(data) >= len(self.serialized_data):
+            return False
+        self.format = storage_format.name
+        self.serialized_data = data
+        self.base_version = base_version
+        self.delta_depth = base_version.delta_depth + 1
+        return True
+
+    def materialize(self):
+        """Stores this saved delta version as a full version."""
+        # The record is resolved from the delta before the data is replaced.
+        record = self.get_record()
+        storage_format = get_storage_format("json")
+        self.format = storage_format.name
+        self.serialized_data = storage_format.encode(dump_record(record))
+        self.base_version = None
+        self.delta_depth = 0
+        Version.objects.using(self._state.db).filter(pk=self.pk).update(
+            format = self.format,
+            serialized_data = self.serialized_data,
+            base_version = None,
+            delta_depth = 0,
+        )
+
+    def get_serialized_data(self):
+        """Returns the serialized data, decompressed if it is stored compressed."""
+        return get_format(self.format).decode(self.serialized_data)
 
     @property
     def field_dict(self):
@@ -239,14 +674,10 @@ class Version(models.Model):
                 if field:
                     parent_id = force_text(getattr(obj, field.attname))
                 else:
-                    parent_id = obj.pk
-                try:
-                    parent_version = Version.objects.get(revision__id=self.revision_id,
-                                                         content_type=content_type,
-                                                         object_id=parent_id)
-                except Version.DoesNotExist:
-                    pass
-                else:
+                    parent_id = force_text(obj.pk)
+                parent_version = self.revision.get_version_index().get(
+                    (content_type.id, parent_id))
+                if parent_version is not None:
                     result.update(parent_version.field_dict)
             setattr(self, "_field_dict_cache", result)
         return getattr(self, "_field_dict_cache")
@@ -262,10 +693,221 @@ class Version(models.Model):
         verbose_name = _(u"Object version")
         verbose_name_plural = _(u"Object versions")
         ordering = ['-revision__date_created']
+        index_together = [
+            ['content_type', 'object_id_int', 'revision'],
+            ['content_type', 'object_id_hash', 'revision'],
+        ]
 
     objects = VersionManager()
 
 
+class LatestApprovedVersionManager(models.Manager):
+    """
+    Custom manager for LatestApprovedVersion model.
+    """
+    def lookup(self, content_type, object_id):
+        """Returns the pointer of the given object or None."""
+        pointers = list(self.filter(
+            **object_lookup(content_type, object_id)
+        ).select_related('version__revision').order_by('-date_moderated')[:1])
+        return pointers[0] if pointers else None
+
+    def point_to(self, version):
+        """Makes the given version current for its object."""
+        self.update_for_revision(version.revision, [version])
+
+    def update_for_revision(self, revision, versions=None):
+        """
+        Updates pointers of all objects contained in the given revision.
+
+        Approved revision becomes current for its objects unless they already
+        point to a revision moderated later. Pointers to a revision which is
+        not approved are dropped, they will be recomputed on next lookup.
+        """
+        if revision.status != VERSION_STATUS_APPROVED:
+            self.filter(revision=revision).delete()
+            return
+        if versions is None:
+            versions = revision.version_set.using(self.db).only(
+                'id', 'revision', 'content_type', 'object_id', 'object_id_int',
+                'object_id_hash')
+        # Group versions by content type and key kind to query in batches.
+        groups = {}
+        for version in versions:
+            field, value = version_key(version)
+            groups.setdefault((version.content_type_id, field), {})[value] = version
+        pointers = []
+        for (content_type_id, field), group in groups.items():
+            for values in lookup_chunks(list(group.keys())):
+                queryset = self.filter(**{
+                    'content_type': content_type_id,
+                    '%s__in' % field: values})
+                if revision.date_moderated is not None:
+                    newer = queryset.filter(date_moderated__gt=revision.date_moderated)
+                    for value in newer.values_list(field, flat=True):
+                        group.pop(value, None)
+                    queryset = queryset.exclude(date_moderated__gt=revision.date_moderated)
+                queryset.delete()
+            pointers.extend(
+                LatestApprovedVersion(
+                    content_type_id=version.content_type_id,
+                    object_id=version.object_id,
+                    object_id_int=version.object_id_int,
+                    object_id_hash=version.object_id_hash,
+                    version=version,
+                    revision=revision,
+                    date_moderated=revision.date_moderated)
+                for version in group.values())
+        self.bulk_create(pointers)
+
+
+class LatestApprovedVersion(models.Model):
+    """
+    A pointer to the latest approved version of an object under version
+    control. It is maintained on revision saves and replaces scanning of
+    all object's versions.
+    """
+
+    content_type = models.ForeignKey(ContentType,
+        related_name="workflow_latest_approved_ct")
+    object_id = models.TextField(
+        help_text="Primary key of the model under version control.")
+    object_id_int = models.IntegerField(
+        blank = True,
+        null = True,
+        help_text = "An indexed, integer version of the stored model's primary key, used for faster lookups.",)
+    object_id_hash = models.CharField(
+        max_length = 40,
+        blank = True,
+        help_text = "A hash of the stored model's non-integer primary key, used for faster lookups.",)
+    version = models.ForeignKey(Version,
+        related_name="+",
+        help_text="The latest approved version of the object.")
+    revision = models.ForeignKey(Revision,
+        related_name="+",
+        help_text="The revision that contains the version.")
+    date_moderated = models.DateTimeField(
+        blank=True, null=True,
+        help_text="The date and time the revision was approved.")
+
+    class Meta:
+        verbose_name = _(u"Latest approved version")
+        verbose_name_plural = _(u"Latest approved versions")
+        index_together = [
+            ['content_type', 'object_id_int'],
+            ['content_type', 'object_id_hash'],
+        ]
+
+    objects = LatestApprovedVersionManager()
+
+
+class FieldSchema(models.Model):
+    """
+    Names of serialized fields of a model, referenced by digest from
+    versions stored in compact serialization formats.
+    """
+
+    digest = models.CharField(
+        max_length = 40,
+        unique = True,
+        help_text = "A digest of the model label and field names.")
+    model = models.CharField(
+        max_length = 255,
+        help_text = "Label of the model, app_label.model_name.")
+    fields = models.TextField(
+        help_text = "Comma separated names of the serialized fields.")
+
+    class Meta:
+        verbose_name = _(u"Field schema")
+        verbose_name_plural = _(u"Field schemas")
+
+    def get_field_names(self):
+        """Returns a list of the serialized field names."""
+        return self.fields.split(",") if self.fields else []
+
+
+class DeferredRevision(models.Model):
+    """
+    A revision queued to be saved later by process_deferred_revisions
+    management command. Only identities of objects are stored, versions
+    are serialized from objects' state at the time the queue is processed.
+    """
+
+    manager_slug = models.CharField(
+        max_length = 200,
+        default = "default")
+    user = models.ForeignKey(User,
+        blank = True,
+        null = True,
+        related_name = "+")
+    comment = models.TextField(
+        blank = True)
+    ignore_duplicates = models.BooleanField(
+        default = False)
+    objects_data = models.TextField(
+        help_text = "JSON list of [content type id, object id, version type] of revision's objects.")
+    date_created = models.DateTimeField(
+        auto_now_add = True)
+    error = models.TextField(
+        blank = True,
+        help_text = "The error the revision couldn't be saved with.")
+
+    class Meta:
+        verbose_name = _(u"Deferred revision")
+        verbose_name_plural = _(u"Deferred revisions")
+        ordering = ['pk']
+
+    def get_objects_data(self):
+        """Returns a list of (content_type_id, object_id, type_flag) tuples."""
+        return [tuple(item) for item in json.loads(self.objects_data)]
+
+    def set_objects_data(self, objects_data):
+        self.objects_data = json.dumps([list(item) for item in objects_data])
+
+    def get_object_keys(self):
+        """Returns a set of (content_type_id, object_id) of revision's objects."""
+        return set(
+            (content_type_id, object_id)
+            for content_type_id, object_id, type_flag in self.get_objects_data())
+
+
+def field_dicts_for_revision(revision):
+    """
+    Returns field dicts of all versions of the given revision, keyed by
+    (content_type_id, object_id). All versions, including parents of
+    multi-table inherited models, are fetched with a single query.
+    """
+    return dict(
+        (key, version.field_dict)
+        for key, version in revision.get_version_index().items())
+
+
+def _get_moderation_state(revision):
+    # Deferred fields are not loaded just to be compared.
+    return (revision.__dict__.get('status'), revision.__dict__.get('date_moderated'))
+
+
+def _revision_post_init_receiver(instance, **kwargs):
+    """Remembers the moderation state of a revision to detect its changes."""
+    instance._moderation_state = _get_moderation_state(instance)
+
+post_init.connect(_revision_post_init_receiver, sender=Revision)
+
+
+def _revision_post_save_receiver(instance, created, using, **kwargs):
+    """
+    Keeps latest approved version pointers in sync with revision status.
+    Pointers are updated only if status or moderation date of the revision
+    changed since it was loaded or last saved.
+    """
+    moderation_state = _get_moderation_state(instance)
+    if not created and moderation_state != getattr(instance, '_moderation_state', None):
+        LatestApprovedVersion.objects.db_manager(using).update_for_revision(instance)
+    instance._moderation_state = moderation_state
+
+post_save.connect(_revision_post_save_receiver, sender=Revision)
+
+
 # Version management signals.
 pre_revision_commit = Signal(providing_args=["instances", "revision", "versions"])
 post_revision_commit = Signal(providing_args=["instances", "revision", "versions"])
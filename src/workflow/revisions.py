@@ -1,35 +1,47 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-import operator, sys
+import os
+import sys
+import json
 import logging
+import tempfile
 
-from functools import wraps, reduce
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from itertools import chain
 from threading import local
 from weakref import WeakValueDictionary
 
+from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
-from django.core import serializers
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.signals import request_finished
 from django.db import models, DEFAULT_DB_ALIAS, connection
-from django.db.models import Q, Max
 from django.db.models.query import QuerySet
 from django.db.models.signals import post_save, pre_delete
-from django.utils.encoding import force_text
+from django.utils.encoding import force_text, force_bytes
 
 from workflow.constants import (
     VERSION_STATUS_APPROVED, VERSION_STATUS_REJECTED, VERSION_STATUS_DRAFT,
     VERSION_TYPES, VERSION_TYPE_ADD, VERSION_TYPE_CHANGE, VERSION_TYPE_DELETE
 )
 from workflow.models import (
-    Revision, Version,
-    has_int_pk,
+    Revision, Version, LatestApprovedVersion, DeferredRevision,
+    has_int_pk, get_digest, get_revision_digest, chunked, chunked_objects_filters, lookup_chunks,
     pre_revision_commit, post_revision_commit,
 )
+from workflow.diff import register_diff_engines
+from workflow.formats import get_format, get_storage_format
+from workflow.settings import (
+    WORKFLOW_BULK_BATCH_SIZE, WORKFLOW_FOLLOW_MAX_DEPTH, WORKFLOW_DELTA_KEYFRAME_INTERVAL,
+    WORKFLOW_DEFERRED_CAPTURE, WORKFLOW_CAPTURE_MAX_PENDING, WORKFLOW_CAPTURE_SPILL_SIZE)
 
 LOG = logging.getLogger(__name__)
 
+# Identity of an object of a version serialized in advance, see save_revision().
+VersionKey = namedtuple("VersionKey", "content_type_id object_id object_id_int object_id_hash")
+
 
 class VersionAdapter(object):
 
@@ -44,9 +56,13 @@ class VersionAdapter(object):
     # Foreign key relationships to follow when saving a version of this model.
     follow = ()
 
-    # The serialization format to use.
+    # The serialization format to use, see workflow.formats.
     format = "json"
 
+    # Diff engines of text fields by field name, see WorkflowAdmin.diff_engines.
+    # None if changes of the model aren't shown on their own, e.g. of inlines.
+    diff_engines = None
+
     def __init__(self, model):
         """Initializes the version adapter."""
         self.model = model
@@ -58,14 +74,22 @@ class VersionAdapter(object):
         content_type = ContentType.objects.db_manager(db).get_for_model(obj)
         if has_int_pk(obj.__class__):
             object_id_int = int(obj.pk)
+            object_id_hash = ""
         else:
             object_id_int = None
+            object_id_hash = get_digest(object_id)
+        serialized_data = self.get_serialized_data(obj)
+        # The digest is computed before compression, so it doesn't depend
+        # on the way data is stored.
+        storage_format = get_storage_format(self.get_serialization_format())
         return {
             "object_id": object_id,
             "object_id_int": object_id_int,
+            "object_id_hash": object_id_hash,
             "content_type": content_type,
-            "format": self.get_serialization_format(),
-            "serialized_data": self.get_serialized_data(obj),
+            "format": storage_format.name,
+            "serialized_data": storage_format.encode(serialized_data),
+            "digest": get_digest(serialized_data),
             "object_repr": force_text(obj),
             "object_type": type_flag
         }
@@ -76,9 +100,8 @@ class VersionAdapter(object):
 
     def get_serialized_data(self, obj):
         """Returns a string of serialized data for the given obj."""
-        return serializers.serialize(
-            self.get_serialization_format(),
-            (obj,),
+        return get_format(self.get_serialization_format()).serialize(
+            obj,
             fields = list(self.get_fields_to_serialize()),
         )
 
@@ -96,30 +119,307 @@ class VersionAdapter(object):
     def get_followed_relations(self, obj):
         """Returns an iterable of related models that should be included in the revision data."""
         for relationship in self.follow:
-            # Clear foreign key cache.
-            try:
-                related_field = obj._meta.get_field(relationship)
-            except models.FieldDoesNotExist:
-                pass
-            else:
-                if isinstance(related_field, models.ForeignKey):
-                    if hasattr(obj, related_field.get_cache_name()):
-                        delattr(obj, related_field.get_cache_name())
-            # Get the referenced obj(s).
-            try:
-                related = getattr(obj, relationship)
-            except ObjectDoesNotExist:
-                continue
-            if isinstance(related, models.Model):
+            for related in self.get_followed_relation(obj, relationship):
                 yield related
-            elif isinstance(related, (models.Manager, QuerySet)):
-                for related_obj in related.all():
-                    yield related_obj
-            elif related is not None:
-                raise TypeError("Cannot follow the relationship {relationship}. Expected a model or QuerySet, found {related}".format(
-                    relationship = relationship,
-                    related = related,
-                ))
+
+    def get_followed_relation(self, obj, relationship):
+        """Returns an iterable of models related to the object by the given relationship."""
+        # Clear foreign key cache.
+        try:
+            related_field = obj._meta.get_field(relationship)
+        except models.FieldDoesNotExist:
+            pass
+        else:
+            if isinstance(related_field, models.ForeignKey):
+                if hasattr(obj, related_field.get_cache_name()):
+                    delattr(obj, related_field.get_cache_name())
+        # Get the referenced obj(s).
+        try:
+            related = getattr(obj, relationship)
+        except ObjectDoesNotExist:
+            return
+        if isinstance(related, models.Model):
+            yield related
+        elif isinstance(related, (models.Manager, QuerySet)):
+            for related_obj in related.all():
+                yield related_obj
+        elif related is not None:
+            raise TypeError("Cannot follow the relationship {relationship}. Expected a model or QuerySet, found {related}".format(
+                relationship = relationship,
+                related = related,
+            ))
+
+    def get_followed_relations_batch(self, objs, stats=None):
+        """
+        Returns an iterable of related models of all the given objects that
+        should be included in the revision data.
+
+        Each relationship is fetched for chunks of objects, see
+        lookup_chunks(), with a query per chunk where possible, otherwise
+        it is followed object by object. If a
+        `stats` dict is given, its "queries" counter is increased by the
+        number of issued queries.
+        """
+        for relationship in self.follow:
+            for chunk in lookup_chunks(objs):
+                queryset = self.get_relation_queryset(relationship, chunk)
+                if queryset is None:
+                    for obj in chunk:
+                        if stats is not None:
+                            stats["queries"] += 1
+                        for related in self.get_followed_relation(obj, relationship):
+                            yield related
+                else:
+                    if stats is not None:
+                        stats["queries"] += 1
+                    for related in queryset:
+                        yield related
+
+    def get_relation_queryset(self, relationship, objs):
+        """
+        Returns a queryset of models related to any of the given objects by
+        the given relationship, or None if the relationship cannot be
+        fetched in bulk.
+        """
+        opts = self.model._meta
+        try:
+            field = opts.get_field(relationship)
+        except models.FieldDoesNotExist:
+            field = None
+        if isinstance(field, models.ForeignKey):
+            values = set(getattr(obj, field.attname) for obj in objs)
+            values.discard(None)
+            return field.rel.to._base_manager.filter(**{
+                "%s__in" % field.rel.field_name: list(values)})
+        pks = [obj.pk for obj in objs]
+        if isinstance(field, models.ManyToManyField):
+            return field.rel.to._default_manager.filter(**{
+                "%s__in" % field.related_query_name(): pks}).distinct()
+        if isinstance(field, generic.GenericRelation):
+            return field.rel.to._default_manager.filter(**{
+                field.content_type_field_name: ContentType.objects.get_for_model(self.model),
+                "%s__in" % field.object_id_field_name: pks})
+        if field is not None:
+            return None
+        # Reverse foreign keys and many-to-many relations.
+        for related in opts.get_all_related_objects():
+            if related.get_accessor_name() == relationship:
+                target_field = related.field.rel.get_related_field()
+                return related.model._default_manager.filter(**{
+                    "%s__in" % related.field.name: [getattr(obj, target_field.attname) for obj in objs]})
+        for related in opts.get_all_related_many_to_many_objects():
+            if related.get_accessor_name() == relationship:
+                return related.model._default_manager.filter(**{
+                    "%s__in" % related.field.name: pks}).distinct()
+        return None
+
+    def get_relation_keys(self, relationship):
+        """
+        Returns a pair of functions returning the value which relates an
+        object to a related model by the given relationship, one for each
+        side, or None if related models cannot be matched to objects so,
+        e.g. for many-to-many relations.
+        """
+        opts = self.model._meta
+        try:
+            field = opts.get_field(relationship)
+        except models.FieldDoesNotExist:
+            field = None
+        if isinstance(field, models.ForeignKey):
+            target_field = field.rel.get_related_field()
+            return (
+                lambda obj: getattr(obj, field.attname),
+                lambda related: getattr(related, target_field.attname))
+        if isinstance(field, generic.GenericRelation):
+            return (
+                lambda obj: force_text(obj.pk),
+                lambda related: force_text(getattr(related, field.object_id_field_name)))
+        if field is not None:
+            return None
+        for related in opts.get_all_related_objects():
+            if related.get_accessor_name() == relationship:
+                target_field = related.field.rel.get_related_field()
+                return (
+                    lambda obj: getattr(obj, target_field.attname),
+                    lambda related_obj: getattr(related_obj, related.field.attname))
+        return None
+
+    def get_followed_relations_map(self, objs, stats=None):
+        """
+        Returns a dict of {obj: list of related models} of the given objects
+        like get_followed_relations_batch(), with related models matched to
+        the objects they are related to. Relationships which cannot be
+        matched, see get_relation_keys(), are followed object by object.
+        """
+        related_objects = dict((obj, []) for obj in objs)
+        for relationship in self.follow:
+            keys = self.get_relation_keys(relationship)
+            for chunk in lookup_chunks(objs):
+                queryset = None
+                if keys is not None:
+                    queryset = self.get_relation_queryset(relationship, chunk)
+                if queryset is None:
+                    for obj in chunk:
+                        if stats is not None:
+                            stats["queries"] += 1
+                        related_objects[obj].extend(self.get_followed_relation(obj, relationship))
+                    continue
+                if stats is not None:
+                    stats["queries"] += 1
+                obj_key, related_key = keys
+                related_by_key = {}
+                for related in queryset:
+                    related_by_key.setdefault(related_key(related), []).append(related)
+                for obj in chunk:
+                    related_objects[obj].extend(related_by_key.get(obj_key(obj), ()))
+        return related_objects
+
+
+class PendingVersion(object):
+
+    """Version data of an object, created when the revision is saved."""
+
+    def __init__(self, adapter, obj, type_flag, db=None):
+        self.adapter = adapter
+        self.obj = obj
+        self.type_flag = type_flag
+        self.db = db
+
+    def __call__(self):
+        return self.adapter.get_version_data(self.obj, self.type_flag, self.db)
+
+
+class VersionDataReader(object):
+
+    """An iterable which calls the given generator function whenever it's iterated."""
+
+    def __init__(self, generator_function):
+        self.generator_function = generator_function
+
+    def __iter__(self):
+        return self.generator_function()
+
+
+class CaptureBuffer(object):
+
+    """
+    Objects captured in a revision context for one revision manager, keyed
+    by (model, primary key), so an object saved several times is captured
+    once, in its latest state.
+
+    Captured objects are kept as PendingVersion and serialized when the
+    revision is saved. Once there are more than `max_pending` of them, they
+    are serialized at once together with the objects they follow, and the
+    instances are released. Serialized data of more than `spill_size`
+    versions is moved to a temporary file.
+    """
+
+    def __init__(self, manager, max_pending=None, spill_size=None):
+        self.manager = manager
+        self.max_pending = max_pending
+        self.spill_size = spill_size
+        # {key: PendingVersion}
+        self._pending = OrderedDict()
+        # {key: version data}
+        self._data = OrderedDict()
+        # {key: sequence number of the data in the spill file}
+        self._spilled = {}
+        self._spill_file = None
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._pending) + len(self._data) + len(self._spilled)
+
+    def _get_key(self, obj):
+        return (obj.__class__, force_text(obj.pk))
+
+    def _has_key(self, key):
+        return key in self._pending or key in self._data or key in self._spilled
+
+    def add(self, obj, version_data):
+        """Captures the object with a PendingVersion or serialized version data."""
+        key = self._get_key(obj)
+        self._pending.pop(key, None)
+        self._data.pop(key, None)
+        self._spilled.pop(key, None)
+        if isinstance(version_data, PendingVersion):
+            self._pending[key] = version_data
+            if self.max_pending is not None and len(self._pending) > self.max_pending:
+                self._serialize_pending()
+        else:
+            self._add_data(key, version_data)
+
+    def _add_data(self, key, version_data):
+        version_data = dict(version_data)
+        version_data["content_type_id"] = version_data.pop("content_type").id
+        self._data[key] = version_data
+        if self.spill_size is not None and len(self._data) > self.spill_size:
+            self._spill()
+
+    def _serialize_pending(self):
+        """Serializes pending objects and objects they follow."""
+        pending = self._pending
+        self._pending = OrderedDict()
+        for key, version_data in pending.items():
+            self._add_data(key, version_data())
+        db = next(iter(pending.values())).db
+        for obj in self.manager._follow_relationships(
+                version_data.obj for version_data in pending.values()):
+            key = self._get_key(obj)
+            if not self._has_key(key):
+                adapter = self.manager.get_adapter(obj.__class__)
+                self._add_data(key, adapter.get_version_data(obj, VERSION_TYPE_CHANGE, db))
+
+    def _spill(self):
+        """Moves serialized data to the spill file."""
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile()
+        self._spill_file.seek(0, os.SEEK_END)
+        for key, version_data in self._data.items():
+            self._sequence += 1
+            self._spilled[key] = self._sequence
+            self._spill_file.write(force_bytes(json.dumps([self._sequence, version_data])) + b"\n")
+        self._data = OrderedDict()
+
+    def is_lazy(self):
+        """Returns whether no captured object has been serialized yet."""
+        return not self._data and not self._spilled
+
+    def get_pending(self):
+        """Returns a dict of {obj: PendingVersion} of objects not serialized yet."""
+        return dict((version_data.obj, version_data) for version_data in self._pending.values())
+
+    def iter_spilled_version_data(self):
+        """Yields data of versions in the spill file, read line by line."""
+        if self._spilled:
+            sequences = set(self._spilled.values())
+            self._spill_file.seek(0)
+            for line in iter(self._spill_file.readline, b""):
+                sequence, version_data = json.loads(force_text(line))
+                if sequence in sequences:
+                    yield version_data
+
+    def get_version_data(self):
+        """Returns a list of data of serialized versions held in memory."""
+        return list(self._data.values())
+
+    def get_spilled_version_data(self):
+        """
+        Returns an iterable of data of spilled versions which reads the
+        spill file anew whenever it's iterated, or an empty tuple.
+        """
+        if not self._spilled:
+            return ()
+        return VersionDataReader(self.iter_spilled_version_data)
+
+    def close(self):
+        """Releases captured objects and removes the spill file."""
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self._pending.clear()
+        self._data.clear()
+        self._spilled.clear()
 
 
 class RevisionManagementError(Exception):
@@ -139,6 +439,8 @@ class RevisionContextManager(local):
 
     def clear(self):
         """Puts the revision manager back into its default state."""
+        for capture_buffer in getattr(self, "_objects", {}).values():
+            capture_buffer.close()
         self._objects = {}
         self._user = None
         self._comment = ""
@@ -180,13 +482,24 @@ class RevisionContextManager(local):
             try:
                 if not self.is_invalid():
                     # Save the revision data.
-                    for manager, manager_context in self._objects.items():
+                    for manager, capture_buffer in self._objects.items():
+                        if self._can_defer(capture_buffer):
+                            manager.defer_revision(
+                                capture_buffer.get_pending(),
+                                user = self._user,
+                                comment = self._comment,
+                                ignore_duplicates = self._ignore_duplicates,
+                                db = self._db,
+                            )
+                            continue
                         manager.save_revision(
                             dict(
-                                (obj, callable(data) and data() or data)
+                                (obj, data())
                                 for obj, data
-                                in manager_context.items()
+                                in capture_buffer.get_pending().items()
                             ),
+                            version_data = capture_buffer.get_version_data(),
+                            spilled_version_data = capture_buffer.get_spilled_version_data(),
                             user = self._user,
                             comment = self._comment,
                             meta = self._meta,
@@ -196,6 +509,15 @@ class RevisionContextManager(local):
             finally:
                 self.clear()
 
+    def _can_defer(self, capture_buffer):
+        """
+        Checks whether the revision can be queued instead of being saved now.
+        Revisions with meta information or serialized objects, e.g. deleted
+        ones whose data had to be captured before they were gone, are always
+        saved now.
+        """
+        return WORKFLOW_DEFERRED_CAPTURE and not self._meta and capture_buffer.is_lazy()
+
     def invalidate(self):
         """Marks this revision as broken, so should not be commited."""
         self._assert_active()
@@ -209,11 +531,13 @@ class RevisionContextManager(local):
         """Adds an object to the current revision."""
         self._assert_active()
         try:
-            manager_context = self._objects[manager]
+            capture_buffer = self._objects[manager]
         except KeyError:
-            manager_context = {}
-            self._objects[manager] = manager_context
-        manager_context[obj] = version_data
+            capture_buffer = CaptureBuffer(manager,
+                max_pending = WORKFLOW_CAPTURE_MAX_PENDING,
+                spill_size = WORKFLOW_CAPTURE_SPILL_SIZE)
+            self._objects[manager] = capture_buffer
+        capture_buffer.add(obj, version_data)
 
     def get_db(self):
         """Returns the current DB alias being used."""
@@ -390,6 +714,9 @@ class RevisionManager(object):
         # Perform the registration.
         adapter_obj = adapter_cls(model)
         self._registered_models[model] = adapter_obj
+        # Let every process saving revisions render changes of the model.
+        if adapter_obj.diff_engines is not None:
+            register_diff_engines(model, adapter_obj.diff_engines)
         # Connect to the post save signal of the model.
         post_save.connect(self._post_save_receiver, model)
         pre_delete.connect(self._pre_delete_receiver, model)
@@ -412,18 +739,80 @@ class RevisionManager(object):
         post_save.disconnect(self._post_save_receiver, model)
         pre_delete.disconnect(self._pre_delete_receiver, model)
 
-    def _follow_relationships(self, objects):
-        """Follows all relationships in the given set of objects."""
+    def _follow_relationships(self, objects, max_depth=None, stats=None):
+        """
+        Follows all relationships in the given set of objects.
+
+        Relationships are followed breadth-first: objects of every level are
+        grouped by model and each followed relationship of a model is
+        fetched with one query per level. At most `max_depth` levels are
+        followed, defaults to WORKFLOW_FOLLOW_MAX_DEPTH setting. If a `stats`
+        dict is given, it receives numbers of followed levels and issued
+        queries.
+        """
+        if max_depth is None:
+            max_depth = WORKFLOW_FOLLOW_MAX_DEPTH
+        if stats is None:
+            stats = {}
+        stats.update(levels=0, queries=0)
         followed = set()
-        def _follow(obj):
-            if obj in followed or obj.pk is None:
-                return
-            followed.add(obj)
-            adapter = self.get_adapter(obj.__class__)
-            for related in adapter.get_followed_relations(obj):
-                _follow(related)
-        for obj in objects:
-            _follow(obj)
+        level = set(obj for obj in objects if obj.pk is not None)
+        while level:
+            followed.update(level)
+            if max_depth is not None and stats["levels"] >= max_depth:
+                break
+            stats["levels"] += 1
+            objects_by_model = {}
+            for obj in level:
+                objects_by_model.setdefault(obj.__class__, []).append(obj)
+            level = set()
+            for model, objs in objects_by_model.items():
+                adapter = self.get_adapter(model)
+                for related in adapter.get_followed_relations_batch(objs, stats):
+                    if related.pk is not None and related not in followed:
+                        level.add(related)
+        LOG.debug("Followed %d objects in %d levels with %d queries.",
+            len(followed), stats["levels"], stats["queries"])
+        return followed
+
+    def _follow_relationships_of_each(self, objects, max_depth=None, stats=None):
+        """
+        Follows relationships of each of the given objects separately like
+        _follow_relationships(), returning a dict of {obj: set of objects
+        followed from it}. Relationships of all the objects are fetched
+        together, with one query per level where possible, see
+        VersionAdapter.get_followed_relations_map().
+        """
+        if max_depth is None:
+            max_depth = WORKFLOW_FOLLOW_MAX_DEPTH
+        if stats is None:
+            stats = {}
+        stats.update(levels=0, queries=0)
+        followed = dict((obj, set([obj])) for obj in objects if obj.pk is not None)
+        levels = dict((obj, set([obj])) for obj in followed)
+        while levels:
+            if max_depth is not None and stats["levels"] >= max_depth:
+                break
+            stats["levels"] += 1
+            objects_by_model = {}
+            for level in levels.values():
+                for obj in level:
+                    objects_by_model.setdefault(obj.__class__, set()).add(obj)
+            related_objects = {}
+            for model, objs in objects_by_model.items():
+                adapter = self.get_adapter(model)
+                related_objects.update(adapter.get_followed_relations_map(list(objs), stats))
+            next_levels = {}
+            for root, level in levels.items():
+                next_level = set(
+                    related for obj in level for related in related_objects[obj]
+                    if related.pk is not None and related not in followed[root])
+                if next_level:
+                    followed[root].update(next_level)
+                    next_levels[root] = next_level
+            levels = next_levels
+        LOG.debug("Followed objects of %d objects in %d levels with %d queries.",
+            len(followed), stats["levels"], stats["queries"])
         return followed
 
     def _get_versions(self, db=None):
@@ -433,12 +822,113 @@ class RevisionManager(object):
             revision__manager_slug = self._manager_slug,
         ).select_related("revision")
 
+    def _is_duplicate_revision(self, digest, versions, db=None):
+        """
+        Checks whether the latest revision amongst the latest previous version
+        of each object has exactly the same data as the given versions.
+        """
+        db = db or DEFAULT_DB_ALIAS
+        # A revision with the same digest contains the same objects, so it is
+        # a duplicate if none of the objects has been versioned after it.
+        candidates = Revision.objects.using(db).filter(
+            manager_slug = self._manager_slug,
+            digest = digest,
+        ).order_by("-pk").values_list("pk", flat=True)[:1]
+        if not candidates:
+            return False
+        return not any(
+            self._get_versions(db).filter(lookup, revision__gt=candidates[0]).exists()
+            for lookup in chunked_objects_filters(versions))
+
+    def _save_versions(self, versions, batch_size=None, db=None):
+        """
+        Saves the given versions inserting them in batches of `batch_size`
+        rows. Zero batch size saves versions one by one.
+        """
+        if batch_size is None:
+            batch_size = WORKFLOW_BULK_BATCH_SIZE
+        # Let formats store what their serialized data refers to.
+        versions_by_format = {}
+        for version in versions:
+            versions_by_format.setdefault(version.format, []).append(version)
+        for format_name, format_versions in versions_by_format.items():
+            get_format(format_name).prepare_save(
+                [version.serialized_data for version in format_versions], db)
+        if not batch_size or len(versions) < 2:
+            for version in versions:
+                version.save(using=db)
+            return
+        Version.objects.using(db).bulk_create(versions, batch_size=batch_size)
+        # Bulk inserts do not set primary keys, so fetch them back.
+        revision_ids = list(set(version.revision_id for version in versions))
+        ids = {}
+        for lookup in chunked_objects_filters(versions, batch_size):
+            ids.update(
+                ((revision_id, content_type_id, object_id), id)
+                for id, revision_id, content_type_id, object_id
+                in Version.objects.using(db).filter(
+                    lookup,
+                    revision__in = revision_ids,
+                ).values_list("id", "revision", "content_type", "object_id")
+            )
+        for version in versions:
+            version.id = ids[(version.revision_id, version.content_type_id, version.object_id)]
+            version._state.adding = False
+            version._state.db = db
+
+    def _save_version_batch(self, revision, versions, parent, batch_size, db):
+        """Saves the given versions of a saved revision."""
+        if not versions:
+            return
+        for version in versions:
+            version.revision = revision
+        if parent is not None and WORKFLOW_DELTA_KEYFRAME_INTERVAL:
+            self._encode_deltas(versions, parent, db)
+        self._save_versions(versions, batch_size, db)
+        # Point approved objects to the new versions.
+        if revision.status == VERSION_STATUS_APPROVED:
+            LatestApprovedVersion.objects.db_manager(db).update_for_revision(
+                revision, versions)
+
+    def _encode_deltas(self, versions, parent, db=None):
+        """
+        Stores the given versions as deltas against versions of the same
+        objects in the parent revision, unless the chain of deltas would
+        reach WORKFLOW_DELTA_KEYFRAME_INTERVAL.
+        """
+        parent_versions = parent.get_version_index()
+        count = 0
+        for version in versions:
+            base_version = parent_versions.get((version.content_type_id, version.object_id))
+            if base_version is None or base_version.delta_depth + 1 >= WORKFLOW_DELTA_KEYFRAME_INTERVAL:
+                continue
+            if version.encode_delta(base_version, db):
+                count += 1
+        LOG.debug("Stored %d of %d versions as deltas.", count, len(versions))
+
     def save_revision(self, objects,
             ignore_duplicates=False, user=None, parent=None, status=VERSION_STATUS_DRAFT, delete=False,
-            comment="", meta=(), db=None):
-        """Saves a new revision."""
+            comment="", meta=(), db=None, batch_size=None, version_data=(),
+            spilled_version_data=()):
+        """
+        Saves a new revision.
+
+        Versions are inserted in batches of `batch_size` rows, which
+        defaults to WORKFLOW_BULK_BATCH_SIZE setting. `version_data` is an
+        iterable of data of objects serialized in advance, with content
+        type given as "content_type_id". Such versions are saved as they
+        are and take precedence over versions of followed objects.
+
+        `spilled_version_data` is like `version_data`, but it's iterated
+        twice: once for identities and digests of the objects and once to
+        save them in batches, so it can read data from a file without
+        holding all of it in memory. Versions of spilled data are the only
+        ones not included in versions sent with revision signals.
+        """
         # Get the db alias.
         db = db or DEFAULT_DB_ALIAS
+        if batch_size is None:
+            batch_size = WORKFLOW_BULK_BATCH_SIZE
         # Adapt the objects to a dict.
         if isinstance(objects, (list, tuple)):
             objects = dict(
@@ -446,29 +936,39 @@ class RevisionManager(object):
                 for obj in objects
             )
         # Create the revision.
-        if objects:
+        if objects or version_data or spilled_version_data:
+            serialized_versions = [Version(**data) for data in version_data]
+            spilled_keys = []
+            spilled_digests = []
+            for data in spilled_version_data:
+                spilled_keys.append(VersionKey(
+                    data["content_type_id"], data["object_id"],
+                    data["object_id_int"], data["object_id_hash"]))
+                spilled_digests.append(data["digest"])
+            if not objects and not serialized_versions and not spilled_keys:
+                return
+            serialized_ids = set(
+                (key.content_type_id, key.object_id)
+                for key in chain(serialized_versions, spilled_keys))
+            content_types = ContentType.objects.db_manager(db)
             # Follow relationships.
             for obj in self._follow_relationships(objects.keys()):
                 if not obj in objects:
+                    if (content_types.get_for_model(obj).id, force_text(obj.pk)) in serialized_ids:
+                        continue
                     adapter = self.get_adapter(obj.__class__)
-                    objects[obj] = adapter.get_version_data(obj, VERSION_TYPE_CHANGE)
+                    objects[obj] = adapter.get_version_data(obj, VERSION_TYPE_CHANGE, db)
             # Create all the versions without saving them
             ordered_objects = list(objects.keys())
             new_versions = [Version(**objects[obj]) for obj in ordered_objects]
+            new_versions.extend(serialized_versions)
+            revision_digest = get_revision_digest(
+                [version.digest for version in new_versions] + spilled_digests)
             # Check if there's some change in all the revision's objects.
             save_revision = True
             if ignore_duplicates:
-                # Find the latest revision amongst the latest previous version of each object.
-                subqueries = [Q(object_id=version.object_id, content_type=version.content_type) for version in new_versions]
-                subqueries = reduce(operator.or_, subqueries)
-                latest_revision = self._get_versions(db).filter(subqueries).aggregate(Max("revision"))["revision__max"]
-                # If we have a latest revision, compare it to the current revision.
-                if latest_revision is not None:
-                    previous_versions = self._get_versions(db).filter(revision=latest_revision).values_list("serialized_data", flat=True)
-                    if len(previous_versions) == len(new_versions):
-                        all_serialized_data = [version.serialized_data for version in new_versions]
-                        if sorted(previous_versions) == sorted(all_serialized_data):
-                            save_revision = False
+                save_revision = not self._is_duplicate_revision(
+                    revision_digest, new_versions + spilled_keys, db)
             # Only save if we're always saving, or have changes.
             if save_revision:
                 # Save a new revision.
@@ -479,6 +979,7 @@ class RevisionManager(object):
                     comment = comment,
                     status = status,
                     deleted = delete,
+                    digest = revision_digest,
                 )
 
                 if (status in [VERSION_STATUS_APPROVED, VERSION_STATUS_REJECTED]):
@@ -492,10 +993,15 @@ class RevisionManager(object):
                 )
                 # Save the revision.
                 revision.save(using=db)
-                # Save version models.
-                for version in new_versions:
-                    version.revision = revision
-                    version.save(using=db)
+                # Save version models, versions of spilled data are
+                # created and saved batch by batch.
+                batches = [new_versions]
+                if spilled_version_data:
+                    batches = chain(batches, (
+                        [Version(**data) for data in batch]
+                        for batch in chunked(spilled_version_data, batch_size or 1)))
+                for versions in batches:
+                    self._save_version_batch(revision, versions, parent, batch_size, db)
                 # Save the meta information.
                 for cls, kwargs in meta:
                     cls._default_manager.db_manager(db).create(revision=revision, **kwargs)
@@ -508,15 +1014,64 @@ class RevisionManager(object):
                 # Return the revision.
                 return revision
 
+    def defer_revision(self, objects, user=None, comment="", ignore_duplicates=False, db=None):
+        """
+        Queues a revision of the given objects to be saved by
+        save_deferred_revision(). Objects are given as a dict of
+        {obj: PendingVersion}, only their identities are stored.
+        """
+        db = db or DEFAULT_DB_ALIAS
+        content_types = ContentType.objects.db_manager(db)
+        deferred_revision = DeferredRevision(
+            manager_slug = self._manager_slug,
+            user = user,
+            comment = comment,
+            ignore_duplicates = ignore_duplicates,
+        )
+        deferred_revision.set_objects_data(
+            (content_types.get_for_model(obj).id, force_text(obj.pk), data.type_flag)
+            for obj, data in objects.items())
+        deferred_revision.save(using=db)
+        return deferred_revision
+
+    def save_deferred_revision(self, deferred_revision, db=None):
+        """
+        Saves a revision queued by defer_revision() from the current state
+        of its objects. Objects are fetched with one query per model,
+        objects deleted meanwhile are skipped.
+        """
+        db = db or DEFAULT_DB_ALIAS
+        content_types = ContentType.objects.db_manager(db)
+        object_ids = {}
+        for content_type_id, object_id, type_flag in deferred_revision.get_objects_data():
+            object_ids.setdefault(content_type_id, {})[object_id] = type_flag
+        objects = {}
+        for content_type_id, type_flags in object_ids.items():
+            model = content_types.get_for_id(content_type_id).model_class()
+            if model is None:
+                continue
+            adapter = self.get_adapter(model)
+            for pks in lookup_chunks(list(type_flags)):
+                for obj in model._base_manager.using(db).filter(pk__in=pks):
+                    objects[obj] = adapter.get_version_data(obj, type_flags[force_text(obj.pk)], db)
+        if not objects:
+            LOG.warning("Objects of deferred revision %s do not exist anymore.", deferred_revision.pk)
+            return None
+        return self.save_revision(objects,
+            user = deferred_revision.user,
+            comment = deferred_revision.comment,
+            ignore_duplicates = deferred_revision.ignore_duplicates,
+            db = db,
+        )
+
     # Signal receivers.
     def _post_save_receiver(self, instance, created, **kwargs):
         """Adds registered models to the current revision, if any."""
         if self._revision_context_manager.is_active() and not self._revision_context_manager.is_managing_manually():
             adapter = self.get_adapter(instance.__class__)
-            if created:
-                version_data = lambda: adapter.get_version_data(instance, VERSION_TYPE_ADD, self._revision_context_manager._db)
-            else:
-                version_data = lambda: adapter.get_version_data(instance, VERSION_TYPE_CHANGE, self._revision_context_manager._db)
+            version_data = PendingVersion(
+                adapter, instance, VERSION_TYPE_ADD if created else VERSION_TYPE_CHANGE,
+                self._revision_context_manager._db)
             self._revision_context_manager.add_to_context(self, instance, version_data)
 
     def _pre_delete_receiver(self, instance, **kwargs):
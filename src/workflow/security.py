@@ -1,14 +1,91 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed
+from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _
-from workflow.settings import CONTENT_ADMIN_GRP_ID, CONTENT_MANAGER_GRP_ID
+from workflow.settings import (
+    CONTENT_ADMIN_GRP_ID, CONTENT_MANAGER_GRP_ID, WORKFLOW_ROLES_CACHE_TIMEOUT)
+
+
+ROLES_CACHE_KEY = "workflow:roles:{user_id}"
+
+
+class WorkflowRoles(object):
+    """Workflow roles of a user."""
+
+    def __init__(self, in_admin_group=False, in_manager_group=False, is_superuser=False):
+        self.is_content_admin = in_admin_group or is_superuser
+        self.is_content_manager = in_manager_group
+
+    def __repr__(self):
+        return "WorkflowRoles(is_content_admin={0!r}, is_content_manager={1!r})".format(
+            self.is_content_admin, self.is_content_manager)
+
+
+def _get_group_membership(user):
+    """Returns a tuple: (in_admin_group, in_manager_group)"""
+    if user.pk is None:
+        return (False, False)
+    cache_key = ROLES_CACHE_KEY.format(user_id=user.pk)
+    if WORKFLOW_ROLES_CACHE_TIMEOUT is not None:
+        membership = cache.get(cache_key)
+        if membership is not None:
+            return membership
+    group_ids = set(
+        force_text(pk) for pk in user.groups.filter(
+            pk__in=(CONTENT_ADMIN_GRP_ID, CONTENT_MANAGER_GRP_ID)
+        ).values_list('pk', flat=True))
+    membership = (
+        force_text(CONTENT_ADMIN_GRP_ID) in group_ids,
+        force_text(CONTENT_MANAGER_GRP_ID) in group_ids)
+    if WORKFLOW_ROLES_CACHE_TIMEOUT is not None:
+        cache.set(cache_key, membership, WORKFLOW_ROLES_CACHE_TIMEOUT)
+    return membership
+
+
+def get_user_roles(user):
+    """
+    Returns workflow roles of the given user.
+
+    Roles are resolved once per user object, i.e. once per request for
+    `request.user`, and are stored in the Django cache if
+    WORKFLOW_ROLES_CACHE_TIMEOUT setting is not None.
+    """
+    roles = getattr(user, '_workflow_roles_cache', None)
+    if roles is None:
+        in_admin_group, in_manager_group = _get_group_membership(user)
+        roles = WorkflowRoles(in_admin_group, in_manager_group, user.is_superuser)
+        user._workflow_roles_cache = roles
+    return roles
 
 
 def is_user_content_admin(user):
-	return user.groups.filter(pk=CONTENT_ADMIN_GRP_ID).exists() \
-        or user.is_superuser
+    return get_user_roles(user).is_content_admin
 
 
 def is_user_content_manager(user):
-	return user.groups.filter(pk=CONTENT_MANAGER_GRP_ID).exists()
+    return get_user_roles(user).is_content_manager
+
+
+def _groups_changed_receiver(instance, action, reverse, pk_set, **kwargs):
+    """Drops cached roles of users whose groups have changed."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        # Groups of a user have changed.
+        if hasattr(instance, '_workflow_roles_cache'):
+            del instance._workflow_roles_cache
+        user_ids = [instance.pk]
+    elif action == 'pre_clear':
+        # All users are going to be removed from a group.
+        user_ids = list(instance.user_set.values_list('pk', flat=True))
+    else:
+        # Users of a group have changed.
+        user_ids = pk_set or []
+    if WORKFLOW_ROLES_CACHE_TIMEOUT is not None:
+        cache.delete_many([ROLES_CACHE_KEY.format(user_id=pk) for pk in user_ids])
+
+m2m_changed.connect(_groups_changed_receiver, sender=User.groups.through)
@@ -10,3 +10,63 @@ from django.conf import settings
 
 CONTENT_ADMIN_GRP_ID = getattr(settings, 'CONTENT_ADMIN_GRP_ID', '1')
 CONTENT_MANAGER_GRP_ID = getattr(settings, 'CONTENT_MANAGER_GRP_ID', '2')
+
+# Number of versions inserted per query when saving a revision.
+# Zero saves versions one by one.
+WORKFLOW_BULK_BATCH_SIZE = getattr(settings, 'WORKFLOW_BULK_BATCH_SIZE', 500)
+
+# Seconds to keep users' workflow roles in the Django cache.
+# None disables caching, roles are then resolved once per request.
+WORKFLOW_ROLES_CACHE_TIMEOUT = getattr(settings, 'WORKFLOW_ROLES_CACHE_TIMEOUT', None)
+
+# Maximal number of deserialized versions kept in a process-level cache.
+# Zero disables the cache.
+WORKFLOW_VERSION_CACHE_SIZE = getattr(settings, 'WORKFLOW_VERSION_CACHE_SIZE', 0)
+
+# Maximal number of relationship levels followed when saving a revision.
+# None follows relationships to any depth.
+WORKFLOW_FOLLOW_MAX_DEPTH = getattr(settings, 'WORKFLOW_FOLLOW_MAX_DEPTH', None)
+
+# Compression of stored serialized data of new versions: 'zlib', 'lzma'
+# or None to store data as is.
+WORKFLOW_COMPRESSION = getattr(settings, 'WORKFLOW_COMPRESSION', None)
+
+# Compression level, 0-9 for zlib and lzma.
+WORKFLOW_COMPRESSION_LEVEL = getattr(settings, 'WORKFLOW_COMPRESSION_LEVEL', 6)
+
+# Every Nth version of an object along a chain of parent revisions is
+# stored in full, the others only with fields changed since the version
+# in the parent revision. Zero stores all versions in full.
+WORKFLOW_DELTA_KEYFRAME_INTERVAL = getattr(settings, 'WORKFLOW_DELTA_KEYFRAME_INTERVAL', 0)
+
+# Queue revisions created in revision contexts (e.g. create_revision blocks)
+# to be saved by process_deferred_revisions command instead of saving them
+# when the context ends.
+WORKFLOW_DEFERRED_CAPTURE = getattr(settings, 'WORKFLOW_DEFERRED_CAPTURE', False)
+
+# Maximal number of objects captured in a revision context which are kept
+# unserialized until the revision is saved. Beyond it, captured objects are
+# serialized at once and released. None keeps all of them.
+WORKFLOW_CAPTURE_MAX_PENDING = getattr(settings, 'WORKFLOW_CAPTURE_MAX_PENDING', None)
+
+# Maximal number of serialized versions of a revision context kept in
+# memory. Beyond it, they are moved to a temporary file. None keeps all
+# of them in memory.
+WORKFLOW_CAPTURE_SPILL_SIZE = getattr(settings, 'WORKFLOW_CAPTURE_SPILL_SIZE', None)
+
+# Diff engine of text fields without an engine set in WorkflowAdmin.diff_engines:
+# 'myers', 'html' (diffs tags separately from text) or 'difflib'.
+WORKFLOW_DIFF_ENGINE = getattr(settings, 'WORKFLOW_DIFF_ENGINE', 'myers')
+
+# Maximal number of edits a diff of a text field may consist of, larger
+# diffs are summarized instead.
+WORKFLOW_DIFF_MAX_COST = getattr(settings, 'WORKFLOW_DIFF_MAX_COST', 2000)
+
+# Maximal number of words of changed lines of a text field diffed word by
+# word, larger hunks of lines are shown as replaced as a whole.
+WORKFLOW_DIFF_MAX_TOKENS = getattr(settings, 'WORKFLOW_DIFF_MAX_TOKENS', 20000)
+
+# Seconds to keep rendered changes between versions and their parent
+# versions in the Django cache. None disables caching, changes are then
+# rendered whenever the changes page is opened.
+WORKFLOW_DIFF_CACHE_TIMEOUT = getattr(settings, 'WORKFLOW_DIFF_CACHE_TIMEOUT', None)
@@ -14,10 +14,15 @@ def workflow_model_submit_row(context):
     change = context['change']
     is_popup = context['is_popup']
     save_as = context['save_as']
-    has_content_admin_permission = context.get(
-        'has_content_admin_permission', True)
-    has_content_manager_permission = context.get(
-        'has_content_manager_permission', False)
+    roles = context.get('workflow_roles')
+    if roles is not None:
+        has_content_admin_permission = roles.is_content_admin
+        has_content_manager_permission = roles.is_content_manager
+    else:
+        has_content_admin_permission = context.get(
+            'has_content_admin_permission', True)
+        has_content_manager_permission = context.get(
+            'has_content_manager_permission', False)
     can_be_branched = context.get('can_be_branched', True)
     change_status_only = context.get('change_status_only', False)
     working_with_version = context.get('working_with_version', False)
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+URLs of an admin site used by workflow tests. Admin classes are
+instantiated on import, so this module is only imported once test
+databases exist, when tests resolve urls.
+"""
+from __future__ import unicode_literals
+
+from django.conf.urls import patterns, url, include
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import Group
+
+from workflow.admin import WorkflowAdmin, VersionAdmin
+from workflow.models import Version
+from workflow.revisions import RevisionManager
+
+
+class GroupAdmin(WorkflowAdmin):
+    revision_manager = RevisionManager("workflow-admin-tests")
+
+
+site = AdminSite(name="workflow-tests")
+site.register(Group, GroupAdmin)
+site.register(Version, VersionAdmin)
+
+urlpatterns = patterns('',
+    url(r'^admin/', include(site.urls)),
+)
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+import difflib
+
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.client import RequestFactory
+from django.utils.encoding import force_text
+from django.utils.six import StringIO
+
+from workflow import admin as workflow_admin, diff, revisions, security, textdiff
+from workflow.constants import (
+    VERSION_STATUS_APPROVED, VERSION_STATUS_NEED_ATTENTION,
+    VERSION_TYPE_CHANGE, VERSION_TYPE_DELETE)
+from workflow.formats import get_format
+from workflow.models import (
+    Revision, Version, LatestApprovedVersion, DeferredRevision,
+    get_digest, object_lookup, post_revision_commit)
+from workflow.revisions import (
+    RevisionManager, RegistrationError, CaptureBuffer, PendingVersion)
+
+
+class RevisionTestCase(TestCase):
+
+    """Registers Group with a revision manager of tests."""
+
+    interval = 4
+
+    def setUp(self):
+        self._interval = revisions.WORKFLOW_DELTA_KEYFRAME_INTERVAL
+        revisions.WORKFLOW_DELTA_KEYFRAME_INTERVAL = self.interval
+        try:
+            self.manager = RevisionManager.get_manager("workflow-tests")
+        except RegistrationError:
+            self.manager = RevisionManager("workflow-tests")
+        self.manager.register(Group, format="json")
+
+    def tearDown(self):
+        self.manager.unregister(Group)
+        revisions.WORKFLOW_DELTA_KEYFRAME_INTERVAL = self._interval
+
+    def save_renamed_revisions(self, group, names, revision=None):
+        """Saves a revision of the group under each name, each a child of the previous one."""
+        saved = []
+        for name in names:
+            group.name = name
+            group.save()
+            revision = self.manager.save_revision([group], parent=revision)
+            saved.append(revision)
+        return saved
+
+
+class DeltaChainTest(RevisionTestCase):
+
+    def test_delta_depth_reaches_keyframe_interval(self):
+        group = Group.objects.create(name="group")
+        revision = None
+        depths = []
+        for i in range(self.interval * 2):
+            group.name = "group {0}".format(i)
+            group.save()
+            revision = self.manager.save_revision([group], parent=revision)
+            version = revision.version_set.get()
+            depths.append(version.delta_depth)
+            self.assertEqual(version.object_version.object.name, group.name)
+        self.assertEqual(depths, list(range(self.interval)) * 2)
+
+    def test_deleting_base_version_materializes_delta(self):
+        group = Group.objects.create(name="group")
+        revision = self.manager.save_revision([group])
+        base = revision.version_set.get()
+        group.name = "renamed group"
+        group.save()
+        revision = self.manager.save_revision([group], parent=revision)
+        self.assertEqual(revision.version_set.get().base_version_id, base.pk)
+        base.delete()
+        version = revision.version_set.get()
+        self.assertIsNone(version.base_version_id)
+        self.assertEqual(version.delta_depth, 0)
+        self.assertFalse(get_format(version.format).is_delta)
+        self.assertEqual(version.object_version.object.name, "renamed group")
+
+
+class CompressVersionsTest(RevisionTestCase):
+
+    def get_versions(self, saved):
+        return [revision.version_set.get() for revision in saved]
+
+    def test_round_trip_keeps_deltas(self):
+        group = Group.objects.create(name="group")
+        saved = self.save_renamed_revisions(group, ["first", "second", "third"])
+        self.assertEqual(
+            [version.format for version in self.get_versions(saved)],
+            ["json", "delta", "delta"])
+        call_command("compress_versions", compression="zlib", stdout=StringIO())
+        versions = self.get_versions(saved)
+        self.assertEqual(
+            [version.format for version in versions],
+            ["json+zlib", "delta+zlib", "delta+zlib"])
+        self.assertEqual(
+            [version.object_version.object.name for version in versions],
+            ["first", "second", "third"])
+        call_command("compress_versions", compression="none", stdout=StringIO())
+        versions = self.get_versions(saved)
+        self.assertEqual(
+            [version.format for version in versions],
+            ["json", "delta", "delta"])
+        self.assertEqual(
+            [version.base_version_id for version in versions[1:]],
+            [version.pk for version in versions[:-1]])
+        self.assertEqual(
+            [version.object_version.object.name for version in versions],
+            ["first", "second", "third"])
+
+
+class SaveRevisionTest(RevisionTestCase):
+
+    def save_revision(self, *args, **kwargs):
+        """Saves a revision, returns it and versions sent with post_revision_commit."""
+        signal_versions = []
+        def receiver(versions, **kwargs):
+            signal_versions.extend(versions)
+        post_revision_commit.connect(receiver)
+        try:
+            revision = self.manager.save_revision(*args, **kwargs)
+        finally:
+            post_revision_commit.disconnect(receiver)
+        return revision, signal_versions
+
+    def test_bulk_insert_fetches_primary_keys(self):
+        groups = [Group.objects.create(name="group {0}".format(i)) for i in range(5)]
+        revision, signal_versions = self.save_revision(groups, batch_size=2)
+        self.assertEqual(
+            sorted((version.pk, version.object_id) for version in signal_versions),
+            sorted(revision.version_set.values_list("pk", "object_id")))
+
+    def test_duplicate_revision_is_skipped(self):
+        group = Group.objects.create(name="group")
+        self.assertIsNotNone(self.manager.save_revision([group], ignore_duplicates=True))
+        self.assertIsNone(self.manager.save_revision([group], ignore_duplicates=True))
+
+    def test_duplicate_digest_of_changed_objects_is_saved(self):
+        group = Group.objects.create(name="group")
+        revision = self.manager.save_revision([group], ignore_duplicates=True)
+        group.name = "renamed group"
+        group.save()
+        self.manager.save_revision([group], ignore_duplicates=True)
+        group.name = "group"
+        group.save()
+        reverted = self.manager.save_revision([group], ignore_duplicates=True)
+        self.assertIsNotNone(reverted)
+        self.assertEqual(reverted.digest, revision.digest)
+
+    def test_spilled_versions_are_saved_and_left_out_of_signals(self):
+        groups = [Group.objects.create(name="group {0}".format(i)) for i in range(4)]
+        object_ids = [force_text(group.pk) for group in groups]
+        adapter = self.manager.get_adapter(Group)
+        capture_buffer = CaptureBuffer(self.manager, max_pending=1, spill_size=1)
+        for group in groups[:3]:
+            capture_buffer.add(group, PendingVersion(adapter, group, VERSION_TYPE_CHANGE))
+        # Deleted objects are serialized when they are captured.
+        capture_buffer.add(groups[3], adapter.get_version_data(groups[3], VERSION_TYPE_DELETE))
+        groups[3].delete()
+        # The first two objects were serialized at once and spilled.
+        self.assertEqual(len(capture_buffer._spilled), 2)
+        try:
+            revision, signal_versions = self.save_revision(
+                dict((obj, data()) for obj, data in capture_buffer.get_pending().items()),
+                version_data = capture_buffer.get_version_data(),
+                spilled_version_data = capture_buffer.get_spilled_version_data(),
+            )
+        finally:
+            capture_buffer.close()
+        self.assertEqual(
+            sorted(revision.version_set.values_list("object_id", flat=True)),
+            sorted(object_ids))
+        self.assertEqual(
+            sorted(version.object_id for version in signal_versions),
+            sorted(object_ids[2:]))
+
+
+class ObjectLookupTest(RevisionTestCase):
+
+    def setUp(self):
+        super(ObjectLookupTest, self).setUp()
+        self.manager.register(Session)
+
+    def tearDown(self):
+        self.manager.unregister(Session)
+        super(ObjectLookupTest, self).tearDown()
+
+    def test_integer_keys_are_looked_up_by_integer(self):
+        group = Group.objects.create(name="group")
+        self.manager.save_revision([group])
+        content_type = ContentType.objects.get_for_model(Group)
+        self.assertEqual(
+            object_lookup(content_type, force_text(group.pk)),
+            {'content_type': content_type, 'object_id_int': group.pk})
+        version = Version.objects.for_object(content_type, force_text(group.pk)).get()
+        self.assertEqual(version.object_id_int, group.pk)
+
+    def test_other_keys_are_looked_up_by_hash(self):
+        session = Session.objects.create(
+            session_key="key", session_data="", expire_date=datetime.datetime.now())
+        self.manager.save_revision([session])
+        content_type = ContentType.objects.get_for_model(Session)
+        self.assertEqual(object_lookup(content_type, "key")['object_id_hash'], get_digest("key"))
+        version = Version.objects.for_object(content_type, "key").get()
+        self.assertIsNone(version.object_id_int)
+        self.assertEqual(version.object_id_hash, get_digest("key"))
+
+
+class RolesCacheTest(TestCase):
+
+    def setUp(self):
+        self._settings = (security.WORKFLOW_ROLES_CACHE_TIMEOUT, security.CONTENT_ADMIN_GRP_ID)
+        self.group = Group.objects.create(name="content admins")
+        security.WORKFLOW_ROLES_CACHE_TIMEOUT = 60
+        security.CONTENT_ADMIN_GRP_ID = self.group.pk
+        cache.clear()
+        self.user = User.objects.create_user("editor", "editor@example.com", "editor")
+
+    def tearDown(self):
+        security.WORKFLOW_ROLES_CACHE_TIMEOUT, security.CONTENT_ADMIN_GRP_ID = self._settings
+        cache.clear()
+
+    def is_content_admin(self):
+        # A fresh user object, as in a new request.
+        return security.is_user_content_admin(User.objects.get(pk=self.user.pk))
+
+    def test_roles_are_memoized_and_cached(self):
+        user = User.objects.get(pk=self.user.pk)
+        self.assertFalse(security.is_user_content_admin(user))
+        with self.assertNumQueries(0):
+            self.assertFalse(security.is_user_content_admin(user))
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(security.is_user_content_admin(user))
+
+    def test_changes_of_user_groups_invalidate_roles(self):
+        self.assertFalse(self.is_content_admin())
+        self.user.groups.add(self.group)
+        self.assertTrue(self.is_content_admin())
+        self.user.groups.remove(self.group)
+        self.assertFalse(self.is_content_admin())
+
+    def test_changes_of_group_users_invalidate_roles(self):
+        self.assertFalse(self.is_content_admin())
+        self.group.user_set.add(self.user)
+        self.assertTrue(self.is_content_admin())
+        self.group.user_set.clear()
+        self.assertFalse(self.is_content_admin())
+
+
+def render_context(template_name, context, context_instance=None):
+    return context
+
+
+class AdminQueriesTest(TestCase):
+
+    urls = "workflow.test_urls"
+
+    def setUp(self):
+        # Admin classes of the test site are created with the test database.
+        from workflow.test_urls import site
+        self.group_admin = site._registry[Group]
+        self.version_admin = site._registry[Version]
+        self.superuser = User.objects.create_superuser("admin", "admin@example.com", "admin")
+        self.factory = RequestFactory()
+        # Pages are not rendered, views return their context.
+        self._render_to_response = workflow_admin.render_to_response
+        workflow_admin.render_to_response = render_context
+
+    def tearDown(self):
+        workflow_admin.render_to_response = self._render_to_response
+
+    def get_request(self):
+        request = self.factory.get("/")
+        # A fresh user object, so roles are not memoized between requests.
+        request.user = User.objects.get(pk=self.superuser.pk)
+        return request
+
+    def save_revisions(self, group, count, status):
+        revision = None
+        for i in range(count):
+            group.name = "{0} {1}".format(group.name.split()[0], i)
+            group.save()
+            revision = self.group_admin.revision_manager.save_revision(
+                [group], parent=revision, status=status, user=self.superuser)
+
+    def count_queries(self, view, *args):
+        """Returns the number of queries of the view once caches are warm."""
+        view(self.get_request(), *args)
+        request = self.get_request()
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            start = len(connection.queries)
+            view(request, *args)
+            return len(connection.queries) - start
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
+
+    def test_history_view_queries_do_not_depend_on_versions(self):
+        few = Group.objects.create(name="few")
+        many = Group.objects.create(name="many")
+        self.save_revisions(few, 1, VERSION_STATUS_APPROVED)
+        self.save_revisions(many, 6, VERSION_STATUS_APPROVED)
+        self.assertEqual(
+            self.count_queries(self.group_admin.history_view, force_text(few.pk)),
+            self.count_queries(self.group_admin.history_view, force_text(many.pk)))
+
+    def test_moderation_queue_queries_do_not_depend_on_versions(self):
+        self.save_revisions(Group.objects.create(name="few"), 1, VERSION_STATUS_NEED_ATTENTION)
+        count = self.count_queries(self.version_admin.changelist_view)
+        self.save_revisions(Group.objects.create(name="many"), 6, VERSION_STATUS_NEED_ATTENTION)
+        self.assertEqual(self.count_queries(self.version_admin.changelist_view), count)
+        context = self.version_admin.changelist_view(self.get_request())
+        self.assertEqual(len(context['action_list']), 7)
+
+
+class DiffEnginesTest(SimpleTestCase):
+
+    texts = [
+        ("", "new text"),
+        ("the quick brown fox", "the quick red fox"),
+        ("first line\nsecond line\nthird line\n", "first line\nchanged line\nthird line\nfourth line\n"),
+        ("<p>Hello <b>world</b></p>", "<p>Hello <i>world</i>!</p>"),
+    ]
+
+    def test_operations_of_all_engines_add_up_to_texts(self):
+        for name, get_diff_operations in diff.DIFF_ENGINES.items():
+            for a, b in self.texts:
+                operations = get_diff_operations(a, b)
+                self.assertEqual("".join(operation['deleted'] for operation in operations), a, name)
+                self.assertEqual("".join(operation['inserted'] for operation in operations), b, name)
+
+    def test_myers_operations_match_difflib_on_word_changes(self):
+        a, b = "the quick brown fox", "the quick red fox"
+        self.assertEqual(textdiff.get_diff_operations(a, b), diff.get_diff_operations(a, b))
+
+    def test_myers_matches_longest_common_subsequence(self):
+        a, b = list("abcabba"), list("cbabac")
+        matched = sum(
+            i2 - i1 for tag, i1, i2, j1, j2 in textdiff.get_opcodes(a, b) if tag == 'equal')
+        self.assertEqual(matched, 4)
+        self.assertGreaterEqual(matched, sum(
+            size for i, j, size in difflib.SequenceMatcher(None, a, b).get_matching_blocks()))
+
+    def test_too_large_diffs(self):
+        self.assertEqual(
+            textdiff.get_diff_operations("a b c d", "e f g h", max_cost=2),
+            [{'operation': 'replace', 'deleted': "a b c d", 'inserted': "e f g h"}])
+        self.assertRaises(
+            textdiff.DiffTooLarge, textdiff.get_diff_operations, "a\nb\nc\n", "d\ne\nf\n", max_cost=2)
+
+    def test_html_engine_keeps_tags_whole(self):
+        a, b = "<p>Hello <b>world</b></p>", "<p>Hello <i>world</i></p>"
+        self.assertEqual(textdiff.get_html_diff_operations(a, b), [
+            {'operation': 'equal', 'deleted': "<p>Hello ", 'inserted': "<p>Hello "},
+            {'operation': 'replace', 'deleted': "<b>", 'inserted': "<i>"},
+            {'operation': 'equal', 'deleted': "world", 'inserted': "world"},
+            {'operation': 'replace', 'deleted': "</b>", 'inserted': "</i>"},
+            {'operation': 'equal', 'deleted': "</p>", 'inserted': "</p>"},
+        ])
+        # Word diffs split tags apart.
+        self.assertIn(
+            {'operation': 'replace', 'deleted': "b", 'inserted': "i"},
+            diff.get_diff_operations(a, b))
+
+
+class CompressedFormatTest(SimpleTestCase):
+
+    def test_round_trip(self):
+        data = '[{"name": "group"}, []]'
+        for name in ("json+zlib", "delta+zlib"):
+            version_format = get_format(name)
+            encoded = version_format.encode(data)
+            self.assertNotEqual(encoded, data)
+            self.assertEqual(version_format.decode(encoded), data)
+        self.assertTrue(get_format("delta+zlib").is_delta)
+
+
+class InitVersionsTest(RevisionTestCase):
+
+    def test_creates_missing_approved_versions(self):
+        groups = [Group.objects.create(name="group {0}".format(i)) for i in range(3)]
+        self.manager.save_revision([groups[0]], status=VERSION_STATUS_APPROVED)
+        content_type = ContentType.objects.get_for_model(Group)
+        options = {"manager": "workflow-tests", "chunk_size": 2, "stdout": StringIO()}
+        call_command("init_versions", "auth.Group", **options)
+        for group in groups:
+            version = Version.objects.for_object(content_type, group.pk).get(
+                revision__status=VERSION_STATUS_APPROVED)
+            self.assertEqual(
+                LatestApprovedVersion.objects.lookup(content_type, group.pk).version_id,
+                version.pk)
+            self.assertEqual(version.object_version.object.name, group.name)
+        revision_count = Revision.objects.count()
+        call_command("init_versions", "auth.Group", **options)
+        self.assertEqual(Revision.objects.count(), revision_count)
+
+
+class ProcessDeferredRevisionsTest(RevisionTestCase):
+
+    def defer_revision(self, group):
+        adapter = self.manager.get_adapter(Group)
+        return self.manager.defer_revision(
+            {group: PendingVersion(adapter, group, VERSION_TYPE_CHANGE)})
+
+    def get_version_count(self, group):
+        return Version.objects.for_object(
+            ContentType.objects.get_for_model(Group), group.pk).count()
+
+    def process(self, **options):
+        call_command("process_deferred_revisions", stdout=StringIO(), stderr=StringIO(), **options)
+
+    def test_revisions_of_failed_objects_wait_for_failed_ones(self):
+        blocked = Group.objects.create(name="blocked")
+        other = Group.objects.create(name="other")
+        failed = self.defer_revision(blocked)
+        failed.error = "Failed"
+        failed.save()
+        later = self.defer_revision(blocked)
+        self.defer_revision(other)
+        self.process()
+        self.assertEqual(self.get_version_count(blocked), 0)
+        self.assertEqual(self.get_version_count(other), 1)
+        self.assertEqual(
+            list(DeferredRevision.objects.order_by("pk").values_list("pk", flat=True)),
+            [failed.pk, later.pk])
+        self.process(delete_failed=True)
+        self.assertEqual(self.get_version_count(blocked), 1)
+        self.assertFalse(DeferredRevision.objects.exists())
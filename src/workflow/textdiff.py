@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Myers O(ND) diff of texts.
+
+Texts are compared line by line first, only replaced hunks of lines are
+compared word by word. HTML is compared tag by tag and text node by text
+node first instead, so changes of markup and of text end up in separate
+hunks. Both passes are bounded: a diff which would need more edits than
+allowed raises DiffTooLarge.
+"""
+from __future__ import unicode_literals
+
+import re
+
+from workflow.settings import WORKFLOW_DIFF_MAX_COST, WORKFLOW_DIFF_MAX_TOKENS
+
+WORD_RE = re.compile(r'(\W+)', re.UNICODE)
+
+# Splits HTML into tags and text nodes between them.
+HTML_NODE_RE = re.compile(r'(<[^<>]*>)')
+
+# Tokens of HTML: tags, entities, words with trailing spaces, runs of
+# whitespace or punctuation and lone '<' or '&'. Tokens add up to the text.
+HTML_TOKEN_RE = re.compile(
+    r'<[^<>]*>|&#?\w+;|\w[\w-]*[ ]*|\s+|[^\w\s<&]+|[<&]', re.UNICODE)
+
+
+class DiffTooLarge(Exception):
+    """Raised when a diff exceeds its budget."""
+
+
+def _matching_pairs(a, b, max_cost=None):
+    """
+    Returns a list of (i, j) pairs of equal items a[i] == b[j] of the
+    shortest edit script of two sequences, found with Myers algorithm in
+    O((N + M) D) time, where D is the number of edits.
+    """
+    n, m = len(a), len(b)
+    max_d = n + m if max_cost is None else min(max_cost, n + m)
+    # Furthest reaching x of diagonal k is v[k + offset].
+    offset = max_d + 1
+    v = [0] * (2 * offset + 1)
+    trace = []
+    for d in range(max_d + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1 + offset] < v[k + 1 + offset]):
+                x = v[k + 1 + offset]
+            else:
+                x = v[k - 1 + offset] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k + offset] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+        # Only diagonals -d..d are reached in round d.
+        trace.append(v[offset - d:offset + d + 1])
+    raise DiffTooLarge("More than {0} edits are needed".format(max_d))
+
+
+def _backtrack(trace, x, y):
+    """
+    Walks the trace of Myers algorithm back and collects equal pairs.
+    trace[d] is the list of furthest reaching x of diagonals -d..d after
+    round d, the last round is not in the trace.
+    """
+    pairs = []
+    for d in range(len(trace), -1, -1):
+        k = x - y
+        if d == 0:
+            prev_x = prev_y = 0
+        else:
+            # Diagonal k of the previous round is v[k + d - 1].
+            v = trace[d - 1]
+            if k == -d or (k != d and v[k - 2 + d] < v[k + d]):
+                prev_k = k + 1
+            else:
+                prev_k = k - 1
+            prev_x = v[prev_k + d - 1]
+            prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            pairs.append((x, y))
+        x, y = prev_x, prev_y
+    pairs.reverse()
+    return pairs
+
+
+def get_opcodes(a, b, max_cost=None):
+    """
+    Returns difflib-like opcodes (tag, i1, i2, j1, j2) which turn sequence
+    `a` into `b`. Common prefix and suffix are matched in linear time.
+    """
+    n, m = len(a), len(b)
+    prefix = 0
+    while prefix < n and prefix < m and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < n - prefix and suffix < m - prefix and a[n - suffix - 1] == b[m - suffix - 1]:
+        suffix += 1
+    pairs = [(i, i) for i in range(prefix)]
+    pairs.extend(
+        (i + prefix, j + prefix) for i, j in
+        _matching_pairs(a[prefix:n - suffix], b[prefix:m - suffix], max_cost))
+    pairs.extend((n - suffix + i, m - suffix + i) for i in range(suffix))
+
+    opcodes = []
+    i = j = 0
+    for pair_i, pair_j in pairs:
+        if i < pair_i or j < pair_j:
+            opcodes.append([_gap_tag(i, pair_i, j, pair_j), i, pair_i, j, pair_j])
+        if opcodes and opcodes[-1][0] == 'equal':
+            opcodes[-1][2] += 1
+            opcodes[-1][4] += 1
+        else:
+            opcodes.append(['equal', pair_i, pair_i + 1, pair_j, pair_j + 1])
+        i, j = pair_i + 1, pair_j + 1
+    if i < n or j < m:
+        opcodes.append([_gap_tag(i, n, j, m), i, n, j, m])
+    return [tuple(opcode) for opcode in opcodes]
+
+
+def _gap_tag(i1, i2, j1, j2):
+    if i1 < i2 and j1 < j2:
+        return 'replace'
+    return 'delete' if i1 < i2 else 'insert'
+
+
+def _append(operations, operation, deleted, inserted):
+    """Appends an operation, merging it with the previous one of the same kind."""
+    if operations and operations[-1]['operation'] == operation:
+        operations[-1]['deleted'] += deleted
+        operations[-1]['inserted'] += inserted
+    else:
+        operations.append({
+            'operation': operation,
+            'deleted': deleted,
+            'inserted': inserted,
+        })
+
+
+def split_html(html):
+    """Returns a list of tags and text nodes of the HTML."""
+    return [node for node in HTML_NODE_RE.split(html) if node]
+
+
+def tokenize_html(html):
+    """Returns a list of tags, entities, words and punctuation of the HTML."""
+    return HTML_TOKEN_RE.findall(html)
+
+
+def _word_operations(operations, a_words, b_words, max_cost):
+    for tag, i1, i2, j1, j2 in get_opcodes(a_words, b_words, max_cost):
+        _append(operations, tag, ''.join(a_words[i1:i2]), ''.join(b_words[j1:j2]))
+
+
+def _diff_operations(a_units, b_units, tokenize, max_cost, max_tokens):
+    """
+    Diffs two lists of units, e.g. lines, and then replaced hunks of units
+    by tokens.
+    """
+    if max_cost is None:
+        max_cost = WORKFLOW_DIFF_MAX_COST
+    if max_tokens is None:
+        max_tokens = WORKFLOW_DIFF_MAX_TOKENS
+    operations = []
+    for tag, i1, i2, j1, j2 in get_opcodes(a_units, b_units, max_cost):
+        deleted = ''.join(a_units[i1:i2])
+        inserted = ''.join(b_units[j1:j2])
+        if tag != 'replace':
+            _append(operations, tag, deleted, inserted)
+            continue
+        a_words = [word for word in tokenize(deleted) if word]
+        b_words = [word for word in tokenize(inserted) if word]
+        if len(a_words) + len(b_words) <= max_tokens:
+            try:
+                _word_operations(operations, a_words, b_words, max_cost)
+                continue
+            except DiffTooLarge:
+                pass
+        _append(operations, 'replace', deleted, inserted)
+    return operations
+
+
+def get_diff_operations(a, b, max_cost=None, max_tokens=None, tokenize=WORD_RE.split):
+    """
+    Returns diff operations of two texts in the form of
+    workflow.diff.get_diff_operations.
+
+    Lines are diffed first, replaced hunks of lines are then diffed by
+    tokens. Hunks of more than `max_tokens` tokens, or whose token diff
+    needs more than `max_cost` edits, are reported as replaced as a whole.
+    DiffTooLarge is raised if the line diff itself needs more than
+    `max_cost` edits. Limits default to WORKFLOW_DIFF_MAX_COST and
+    WORKFLOW_DIFF_MAX_TOKENS settings.
+    """
+    return _diff_operations(
+        a.splitlines(True), b.splitlines(True), tokenize, max_cost, max_tokens)
+
+
+def get_html_diff_operations(a, b, max_cost=None, max_tokens=None):
+    """
+    Returns diff operations of two HTML texts like get_diff_operations,
+    but tags and text nodes are diffed first, so a changed tag doesn't
+    turn the text around it into a replaced hunk. Replaced hunks are
+    diffed by tokens of tokenize_html(), tags being single tokens.
+    """
+    return _diff_operations(
+        split_html(a), split_html(b), tokenize_html, max_cost, max_tokens)
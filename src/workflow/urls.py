@@ -1,6 +1,7 @@
 from django.conf.urls import patterns
 from django.core.urlresolvers import reverse
 from django.contrib.admin.util import quote
+from django.utils.encoding import iri_to_uri
 
 # URL patterns for workflow
 
@@ -37,3 +38,44 @@ def version_history_url(object_id, site_name, opts):
     return reverse("%s:%s_%s_history" % (
         site_name, opts.app_label, opts.module_name),
         args=(quote(object_id),))
+
+
+URL_ARG_PLACEHOLDER = "__workflow_arg{0}__"
+
+
+def url_builder(url_name, arity):
+    """
+    Reverses the given url once and returns a function which builds it for
+    the given arguments, quoting them the same way as `reverse` does.
+    """
+    placeholders = [URL_ARG_PLACEHOLDER.format(i) for i in range(arity)]
+    url = reverse(url_name, args=placeholders)
+    parts = []
+    for placeholder in placeholders:
+        part, url = url.split(placeholder, 1)
+        parts.append(part)
+    parts.append(url)
+
+    def build(*args):
+        result = [parts[0]]
+        for arg, part in zip(args, parts[1:]):
+            result.append(iri_to_uri(quote(arg)))
+            result.append(part)
+        return "".join(result)
+    return build
+
+
+def version_url_builders(site_name, opts):
+    """
+    Returns a dict of functions which build urls of version actions for
+    the given object id and version id, keyed by action.
+    """
+    info = (site_name, opts.app_label, opts.module_name)
+    recover_url = url_builder("%s:%s_%s_recover" % info, 1)
+    return {
+        'edit_url': url_builder("%s:%s_%s_edit" % info, 2),
+        'view_url': url_builder("%s:%s_%s_changes" % info, 2),
+        'approve_url': url_builder("%s:%s_%s_approve" % info, 2),
+        'reject_url': url_builder("%s:%s_%s_reject" % info, 2),
+        'recover_url': lambda object_id, version_id: recover_url(version_id),
+    }